@@ -1,200 +1,36 @@
 import streamlit as st
-import openai
-import os
-import sqlite3
-import hashlib
-import datetime
-import io
+import pandas as pd  # Streamlitの依存パッケージ（統計表示用）
 import time
 from dotenv import load_dotenv
 
-# 追加ライブラリ
-import docx  # Word文書処理用
-import pptx  # PowerPoint処理用
-import PyPDF2  # PDF処理用（新規追加）
+# 生成・校閲・抽出の中核処理（Streamlitに依存しない部分はcore.pyに集約）
+from core import (
+    create_client,
+    init_db,
+    register_user,
+    authenticate_user,
+    save_history,
+    delete_history_item,
+    delete_all_user_history,
+    get_user_history,
+    get_usage_stats,
+    get_llm_call_stats,
+    find_similar_history,
+    extract_text_from_file,
+    build_generation_prompt,
+    build_proofreading_prompt,
+    call_llm,
+    llm_scheduler,
+    PRIORITY_TEXT_LENGTH,
+)
+from fingerprint import compute_minhash, make_text_diff
 
-# OpenAI APIキーの設定
-api_key = os.environ.get("OPENAI_API_KEY")
-if not api_key:
+# OpenAIクライアントの初期化（APIキーは環境変数から取得）
+client = create_client()
+if client is None:
     st.error("OpenAI APIキーが設定されていません。Renderのダッシュボードで環境変数を設定してください。")
     st.stop()
 
-# OpenAIクライアントの初期化
-import httpx
-http_client = httpx.Client()
-client = openai.OpenAI(api_key=api_key, http_client=http_client)
-
-# SQLiteデータベースのセットアップ
-def init_db():
-    conn = sqlite3.connect('app_data.db')
-    c = conn.cursor()
-    
-    # ユーザーテーブルの作成（存在しない場合）
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        password_hash TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
-    
-    # 履歴テーブルの作成（存在しない場合）
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS history (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        action_type TEXT NOT NULL,
-        content TEXT,
-        result TEXT,
-        file_name TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )
-    ''')
-    
-    conn.commit()
-    conn.close()
-
-# パスワードハッシュ化関数
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
-# ユーザー登録関数
-def register_user(username, password):
-    conn = sqlite3.connect('app_data.db')
-    c = conn.cursor()
-    
-    try:
-        hashed_password = hash_password(password)
-        c.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", 
-                 (username, hashed_password))
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        # ユーザー名が既に存在する場合
-        return False
-    finally:
-        conn.close()
-
-# ユーザー認証関数
-def authenticate_user(username, password):
-    conn = sqlite3.connect('app_data.db')
-    c = conn.cursor()
-    
-    hashed_password = hash_password(password)
-    c.execute("SELECT id FROM users WHERE username = ? AND password_hash = ?", 
-             (username, hashed_password))
-    user = c.fetchone()
-    conn.close()
-    
-    if user:
-        return user[0]  # ユーザーIDを返す
-    else:
-        return None
-
-# 履歴を保存する関数（日本時間のタイムスタンプを使用）
-def save_history(user_id, action_type, content, result, file_name=None):
-    conn = sqlite3.connect('app_data.db')
-    c = conn.cursor()
-    
-    # タイムスタンプを日本時間（JST）で生成
-    jst_now = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=9)))
-    jst_timestamp = jst_now.strftime('%Y-%m-%d %H:%M:%S')
-    
-    c.execute("""
-    INSERT INTO history (user_id, action_type, content, result, file_name, created_at) 
-    VALUES (?, ?, ?, ?, ?, ?)
-    """, (user_id, action_type, content, result, file_name, jst_timestamp))
-    
-    conn.commit()
-    conn.close()
-
-# 単一の履歴を削除する関数
-def delete_history_item(history_id):
-    conn = sqlite3.connect('app_data.db')
-    c = conn.cursor()
-    
-    c.execute("DELETE FROM history WHERE id = ?", (history_id,))
-    
-    conn.commit()
-    deleted = c.rowcount > 0
-    conn.close()
-    
-    return deleted
-
-# ユーザーの全履歴を削除する関数
-def delete_all_user_history(user_id):
-    conn = sqlite3.connect('app_data.db')
-    c = conn.cursor()
-    
-    c.execute("DELETE FROM history WHERE user_id = ?", (user_id,))
-    
-    conn.commit()
-    deleted_count = c.rowcount
-    conn.close()
-    
-    return deleted_count
-
-# ユーザーの履歴を取得する関数（IDを含める）
-def get_user_history(user_id):
-    conn = sqlite3.connect('app_data.db')
-    c = conn.cursor()
-    
-    c.execute("""
-    SELECT id, action_type, content, result, file_name, created_at 
-    FROM history 
-    WHERE user_id = ? 
-    ORDER BY created_at DESC
-    """, (user_id,))
-    
-    history = c.fetchall()
-    conn.close()
-    
-    return history
-
-# ファイルからテキストを抽出する関数
-def extract_text_from_file(uploaded_file):
-    file_type = uploaded_file.name.split('.')[-1].lower()
-    text = ""
-    file_content = uploaded_file.getvalue()
-    
-    try:
-        if file_type == 'txt':
-            # テキストファイルの処理
-            text = uploaded_file.getvalue().decode('utf-8')
-        
-        elif file_type in ['docx', 'doc']:
-            # Wordファイルの処理
-            doc = docx.Document(io.BytesIO(file_content))
-            text = "\n".join([paragraph.text for paragraph in doc.paragraphs if paragraph.text])
-        
-        elif file_type in ['pptx', 'ppt']:
-            # PowerPointファイルの処理
-            prs = pptx.Presentation(io.BytesIO(file_content))
-            
-            for slide in prs.slides:
-                for shape in slide.shapes:
-                    if hasattr(shape, "text"):
-                        text += shape.text + "\n"
-        
-        elif file_type == 'pdf':
-            # PDFファイルの処理（新規追加）
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
-            
-            # PDFの各ページからテキストを抽出
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                text += page.extract_text() + "\n"
-        
-        else:
-            text = "サポートされていないファイル形式です。"
-    
-    except Exception as e:
-        text = f"ファイルの処理中にエラーが発生しました: {str(e)}"
-    
-    return text
-
 # データベースの初期化
 init_db()
 
@@ -215,6 +51,37 @@ if 'username' not in st.session_state:
 if 'confirm_delete_all' not in st.session_state:
     st.session_state.confirm_delete_all = False
 
+# 入力テキストのMinHash署名を計算する関数（再実行のたびに計算しないよう入力ごとにキャッシュ）
+@st.cache_data(max_entries=32, show_spinner=False)
+def cached_minhash(text):
+    return compute_minhash(text)
+
+# LLMの順番待ち状況を表示するコールバックを作成する関数
+def queue_status_callback(placeholder):
+    def on_wait(position, est_wait):
+        placeholder.info(f"順番待ち中です: {position}番目（推定待ち時間 約{est_wait:.0f}秒）")
+    return on_wait
+
+# LLMの応答待ちの経過時間を表示するコールバックを作成する関数
+# （画面を定期的に更新するため、キャンセルボタンによる再実行で呼び出しが中断される）
+def progress_callback(placeholder):
+    def on_progress(elapsed):
+        placeholder.caption(f"応答を待っています…（{elapsed:.0f}秒経過）")
+    return on_progress
+
+# 実行中のLLM呼び出しのキャンセル（ボタンのコールバック）
+def request_cancel():
+    st.session_state.llm_cancelled = True
+
+# キャンセルボタンを表示する関数
+def cancel_button(placeholder, key):
+    placeholder.button("キャンセル", key=key, on_click=request_cancel)
+
+# 直前の呼び出しがキャンセルされた場合に通知する関数
+def show_cancelled_notice():
+    if st.session_state.pop("llm_cancelled", False):
+        st.info("リクエストをキャンセルしました。")
+
 # ログイン機能
 def login_page():
     st.title("ログイン")
@@ -284,6 +151,18 @@ def sidebar_menu():
             label_visibility="visible"  # ラベルを表示する
         )
         
+        # LLMの混雑状況
+        with st.expander("混雑状況"):
+            metrics = llm_scheduler.metrics()
+            st.write(f"- 実行中: {metrics['running']}件")
+            st.write(f"- 待ち行列: {metrics['queue_depth']}件（優先 {metrics['priority_queue_depth']}件）")
+            st.write(f"- 平均待ち時間: 優先 {metrics['priority_wait_avg']:.1f}秒 / 通常 {metrics['standard_wait_avg']:.1f}秒")
+            st.write(f"- 待ち時間（p95）: 優先 {metrics['priority_wait_p95']:.1f}秒 / 通常 {metrics['standard_wait_p95']:.1f}秒")
+            call_stats = get_llm_call_stats()
+            st.write(f"- 再リクエスト率: {call_stats['hedge_rate']:.1%}（直近{call_stats['calls']}件）")
+            st.write(f"- 無駄になった推定トークン数: {call_stats['wasted_tokens']:,}")
+            st.write(f"- タイムアウト: {call_stats['timeouts']}件 / キャンセル: {call_stats['cancelled']}件")
+
         st.divider()
         st.write("生成・校閲アプリケーション")
         
@@ -316,6 +195,7 @@ def main():
 # テキスト生成機能
 def text_generation(model, temperature):
     st.header("テキスト生成")
+    show_cancelled_notice()
     
     prompt_type = st.selectbox(
         "生成するテキストのタイプ:",
@@ -336,106 +216,23 @@ def text_generation(model, temperature):
             st.warning("トピックを入力してください。")
         else:
             with st.spinner("AIが文章を生成中..."):
-                prompt = f"""
-                次の条件に合うテキストを生成してください:
-                - タイプ: {prompt_type}
-                - トピック: {topic}
-                - 長さ: {length}
-                - 追加情報: {additional_info}
-                
-                #金融機関生成AIエージェント
-                あなたは金融機関の広告作成を専門的に支援するAIアシスタントです。
-                金融商品・サービスの広告作成において、法令遵守と効果的なコミュニケーションを両立させる提案を行います。
-
-                ## 基本方針
-                - 金融商品取引法、銀行法、保険業法など関連法規に完全準拠した広告コンテンツを生成する
-                - 誤解を招く表現や過度な期待を抱かせる表現を徹底的に排除する
-                - リスクとリターンの適切なバランスを保った説明を心がける
-                - 対象顧客層に応じた適切な表現と情報量を選択する
-                - 金融機関としての信頼性・安定性を表現しつつ、差別化ポイントを明確に伝える
-
-                ## 広告種類別のガイドライン
-                    **Web広告・バナー**
-                     - 簡潔で明確なメッセージと視覚的一貫性
-                     - クリック後のランディングページとの整合性
-                     - 小さなスペースでも必要な免責事項を表示
-                     - CTAの明確さと行動喚起の適切さ
-
-                    **パンフレット・商品説明資料**
-                    - 段階的な情報提供による理解促進
-                    - 重要事項の視認性確保
-                    - 図表・イラストの効果的活用
-                    - 商品構造・手数料体系の透明な説明
-
-                    **ソーシャルメディア投稿**
-                    - プラットフォーム特性に合わせた最適な表現
-                    - エンゲージメントと法令遵守のバランス
-                    - シリーズ投稿による段階的な情報提供
-                    - コメント対応のための想定Q&A
-
-                ## コンプライアンス要件
-                    **必須開示事項**
-                    - 金融機関名・登録番号
-                    - 手数料・費用の明示
-                    - リスク情報の適切な開示
-                    - 実績数値使用時の出典・条件明示
-
-                    **禁止表現**
-                    - 元本保証がない商品の「安全」「確実」等の表現
-                    - 利回り・リターンの断定的表現
-                    - 他社比較における不適切な優位性主張
-                    - 顧客の投資判断を誤らせる表現
-
-                    **適正表示**
-                    - リスク文言の視認性（文字サイズ、表示時間等）
-                    - 条件付き表現の条件明示
-                    - 専門用語の平易な説明
-                    - 図表・グラフの適切な縮尺と説明
-
-                ## 広告効果向上のポイント
-                    **ターゲティング**
-                    - 顧客セグメント別のニーズ・関心事への合致
-                    - 金融リテラシーレベルに応じた表現の選択
-                    - ライフイベントに合わせたメッセージング
-                    - 商品特性と顧客属性のマッチング
-
-                    **差別化要素**
-                    - 金利・手数料等の定量的優位性
-                    - サービス・サポートの質的優位性
-                    - テクノロジー・利便性の革新性
-                    - 社会的意義・ESG要素の訴求
-
-                    **心理的アプローチ**
-                    - 安心感・信頼性の醸成
-                    - 将来不安の解消・目標達成の支援
-                    - 社会的証明による後押し
-                    - 希少性・適時性の適切な強調
-
-                ## 生成プロセス
-                    1. 広告目的と対象商品・サービスの明確化
-                    2. ターゲット顧客層と媒体の特定
-                    3. 主要メッセージと差別化ポイントの設定
-                    4. コンプライアンス要件の確認とリスク開示の組み込み
-                    5. 広告クリエイティブの生成（複数バージョン）
-                    6. コンプライアンス最終チェック
-
-                ## 注意事項
-                    - 投資・保険商品の広告はとりわけ厳格な規制があることを常に意識する
-                    - 広告表現の解釈は多様であることを考慮し、慎重な表現選択を行う
-                    - ハルシネーション（誤った情報の生成）を防止し、不確かな内容は含めない
-                    - 最新の金融規制に基づいた広告表現を心がけ、必要に応じて確認を促す
-                    - 生成した広告案は必ず金融機関のコンプライアンス部門の確認を受けるよう注記する
-                    効果的な訴求と厳格なコンプライアンス準拠を両立し、金融機関と顧客双方の価値を高める広告制作を支援します。
-                """
+                prompt = build_generation_prompt(prompt_type, topic, length, additional_info)
+                queue_status = st.empty()
+                cancel_area = st.empty()
+                cancel_button(cancel_area, "cancel_generation")
                 
                 try:
-                    response = client.chat.completions.create(
-                        model=model,
-                        messages=[{"role": "user", "content": prompt}],
-                        temperature=temperature,
+                    # SMS・SNS投稿は優先レーンで実行
+                    result = call_llm(
+                        client, model, prompt, temperature,
+                        user_id=st.session_state.user_id,
+                        priority=prompt_type in ["SMS", "SNS投稿"],
+                        on_wait=queue_status_callback(queue_status),
+                        action_type="テキスト生成",
+                        on_progress=progress_callback(queue_status)
                     )
-                    
-                    result = response.choices[0].message.content
+                    queue_status.empty()
+                    cancel_area.empty()
                     
                     # 履歴に保存
                     save_history(
@@ -463,11 +260,14 @@ def text_generation(model, temperature):
                     )
                 
                 except Exception as e:
+                    queue_status.empty()
+                    cancel_area.empty()
                     st.error(f"エラーが発生しました: {str(e)}")
 
 # テキスト校閲機能
 def text_proofreading(model, temperature):
     st.header("テキスト校閲")
+    show_cancelled_notice()
     
     # 入力方式の選択
     input_method = st.radio(
@@ -477,6 +277,7 @@ def text_proofreading(model, temperature):
     )
     
     input_text = ""
+    original_text = ""  # 比較表示用の正規化前のテキスト
     file_name = None
     
     if input_method == "テキスト直接入力":
@@ -509,11 +310,35 @@ def text_proofreading(model, temperature):
             
             # ファイルからテキストを抽出
             with st.spinner("ファイルからテキストを抽出中..."):
-                input_text = extract_text_from_file(uploaded_file)
+                normalized, extract_error = extract_text_from_file(uploaded_file)
+                input_text = normalized.text if normalized else ""
+                original_text = normalized.original if normalized else ""
                 
-                if input_text:
+                if extract_error:
+                    st.error(extract_error)
+                elif input_text:
                     st.subheader("抽出されたテキスト:")
                     st.write(input_text[:1000] + ("..." if len(input_text) > 1000 else ""))
+
+                    # 正規化によるトークン削減量
+                    st.caption(
+                        f"ヘッダー・フッターや改行・空白を整理し、推定トークン数を"
+                        f"{normalized.original_tokens:,} → {normalized.tokens:,}"
+                        f"（{normalized.token_reduction:.0%}削減）にしました。"
+                    )
+                    edits = normalized.edits()
+                    if edits:
+                        with st.expander(f"正規化で除去・変更した箇所（{len(edits)}件）"):
+                            # 元のテキスト中の範囲と正規化後の文字列を並べて表示
+                            for start, end, replacement in edits[:200]:
+                                lines = normalized.original[start:end].splitlines()
+                                before = " / ".join(line.strip() for line in lines if line.strip())
+                                if replacement.strip():
+                                    st.write(f"- `{before}` → `{replacement.strip()}`")
+                                else:
+                                    st.write(f"- 除去: `{before}`")
+                            if len(edits) > 200:
+                                st.write("...")
                     
                     # テキスト全体の表示トグル
                     if len(input_text) > 1000:
@@ -527,7 +352,33 @@ def text_proofreading(model, temperature):
                             )
                 else:
                     st.error("テキストを抽出できませんでした。")
-    
+
+    # 類似する過去の校閲結果の表示
+    if input_text:
+        similar_history = find_similar_history(
+            st.session_state.user_id,
+            input_text,
+            signature=cached_minhash(input_text)
+        )
+        if similar_history:
+            st.subheader("類似する過去の校閲結果")
+            st.caption("過去に校閲した文面と類似しています。以前の修正内容を再利用できます。")
+            for history_id, similarity, past_content, past_result, past_file_name, timestamp in similar_history:
+                similar_title = f"類似度 {similarity:.0%} - {timestamp}"
+                if past_file_name:
+                    similar_title += f" ({past_file_name})"
+
+                with st.expander(similar_title):
+                    diff_text = make_text_diff(past_content, input_text)
+                    st.write("**過去の入力との差分:**")
+                    if diff_text:
+                        st.code(diff_text, language="diff")
+                    else:
+                        st.write("差分はありません。")
+
+                    st.write("**過去の校閲結果:**")
+                    st.markdown(past_result)
+
     check_options = st.multiselect(
         "確認項目:",
         ["景品表示法への抵触がないか","金融商品取引法への抵触がないか","文法/スペル","わかりやすさ", "一貫性"]
@@ -538,91 +389,23 @@ def text_proofreading(model, temperature):
             st.warning("テキストを入力またはファイルをアップロードしてください。")
         else:
             with st.spinner("AIが校閲中..."):
-                checks = ", ".join(check_options) if check_options else "すべての側面"
-                
-                prompt = f"""
-                #金融機関校閲AIエージェント
-                あなたは金融機関の文書校閲を専門とするAIアシスタントです。
-                正確で信頼性の高い校閲サービスを提供し、金融業界特有の表現、規制要件、コンプライアンスを考慮した適切な修正提案を行います。
-                以下のテキストを校閲してください。{checks}に注目して改善点を指摘し、
-                修正案を提案してください。元のテキストを尊重しつつ、より明確で効果的な表現を目指してください。
-                
-                 テキスト:
-                {input_text}
-                
-                以下の形式で回答してください：
-                1. 全体的な評価
-                2. 具体的な改善点（元の文と修正案を対比）
-                3. 修正後の全文
-
-                ## 校閲の基本方針
-                    - 金融関連法規制に準拠した表現であるかを厳格に確認する
-                    - 数値、金額、日付、商品名等の正確性を最優先で確認する
-                    - 専門用語と平易な表現のバランスを適切に保つ
-                    - 表現の一貫性と統一性を確保する
-                    - リスク開示が適切かつ十分であるかを確認する
-                    - わかりやすさと正確さを両立した文章構成を心がける
-
-                ## 校閲対象文書
-                    **顧客向け資料**
-                    - 金融商品説明資料・パンフレット
-                    - 契約書・約款
-                    - 重要事項説明書
-                    - 顧客宛て通知文
-
-                    **内部文書**
-                    - 業務マニュアル・手順書
-                    - 社内報告書・提案書
-                    - 社内規程・ポリシー
-                    - 研修資料
-
-                    **公開文書**
-                    - プレスリリース
-                    - IR資料・ディスクロージャー
-                    - 採用情報・企業案内
-                    - ウェブサイトコンテンツ
-
-                ## 校閲のポイント
-                    **法令遵守の観点**
-                    - 誤解を招く表現や断定的な表現の排除
-                    - 優位性を示す表現の適切性確認
-                    - 必要な免責事項・注意書きの確認
-                    - 個人情報保護に関する表現の確認
-
-                    **表現・用語の観点**
-                    - 専門用語の適切な使用と説明
-                    - 敬語・謙譲語・丁寧語の正しい使用
-                    - カタカナ語・外来語の統一表記
-                    - 曖昧表現・冗長表現の修正
-
-                    **構成・可読性の観点**
-                    - 論理展開の一貫性と明確さ
-                    - 段落構成・見出しの適切性
-                    - 箇条書き・図表の効果的な活用
-                    - フォントサイズ・書式の統一性
-
-                    **金融特有の観点**
-                    - リスク・リターンのバランスある説明
-                    - 手数料・費用の明確な表示
-                    - 数値・計算例の正確性
-                    - 市場予測に関する適切な表現
-
-                ## 注意事項
-                    - 内容の事実確認は行わず、表現・構成のみを校閲する
-                    - 業界固有の専門用語や略語の使用については慎重に判断する
-                    - ハルシネーション（誤った情報の生成）を防止し、不確かな修正は提案しない
-                    - 文書の目的や対象読者を考慮した校閲を心がける
-                    - 金融商品の内容自体に関する評価・判断は行わない
-                """
+                prompt = build_proofreading_prompt(input_text, check_options)
+                queue_status = st.empty()
+                cancel_area = st.empty()
+                cancel_button(cancel_area, "cancel_proofreading")
                 
                 try:
-                    response = client.chat.completions.create(
-                        model=model,
-                        messages=[{"role": "user", "content": prompt}],
-                        temperature=temperature,
+                    # SMS・SNS投稿程度の短いテキストは優先レーンで実行
+                    result = call_llm(
+                        client, model, prompt, temperature,
+                        user_id=st.session_state.user_id,
+                        priority=len(input_text) <= PRIORITY_TEXT_LENGTH,
+                        on_wait=queue_status_callback(queue_status),
+                        action_type="テキスト校閲",
+                        on_progress=progress_callback(queue_status)
                     )
-                    
-                    result = response.choices[0].message.content
+                    queue_status.empty()
+                    cancel_area.empty()
                     
                     # 履歴に保存
                     save_history(
@@ -652,9 +435,10 @@ def text_proofreading(model, temperature):
                         col1, col2 = st.columns(2)
                         with col1:
                             st.subheader("元のテキスト")
+                            # ファイルの場合は正規化前の抽出テキストを表示
                             st.text_area(
                                 label="元のテキスト", 
-                                value=input_text, 
+                                value=original_text or input_text, 
                                 height=300, 
                                 key="original_text_area",
                                 label_visibility="collapsed"  # ラベルを非表示（存在するが表示しない）
@@ -672,10 +456,24 @@ def text_proofreading(model, temperature):
                             )
                 
                 except Exception as e:
+                    queue_status.empty()
+                    cancel_area.empty()
                     st.error(f"エラーが発生しました: {str(e)}")
 # 履歴閲覧機能（削除機能追加）
 def view_history():
     st.header("利用履歴")
+
+    view_mode = st.radio(
+        "表示内容:",
+        ["履歴一覧", "統計"],
+        horizontal=True,
+        label_visibility="collapsed"
+    )
+
+    # 統計は集計テーブルのみを参照するため、履歴本体は読み込まない
+    if view_mode == "統計":
+        view_usage_stats()
+        return
     
     history = get_user_history(st.session_state.user_id)
     
@@ -779,6 +577,41 @@ def view_history():
                             key=f"download_single_{i}"
                         )
 
+# 利用統計の表示機能
+def view_usage_stats():
+    totals, file_types, daily = get_usage_stats(st.session_state.user_id)
+
+    if not totals:
+        st.info("まだ履歴がありません。")
+        return
+
+    # 操作タイプ別の合計
+    st.subheader("操作タイプ別の合計")
+    cols = st.columns(len(totals))
+    for col, (action_type, count, chars_in, chars_out) in zip(cols, totals):
+        with col:
+            st.metric(action_type, f"{count}件")
+            st.caption(f"入力 {chars_in:,}文字 / 出力 {chars_out:,}文字")
+
+    # ファイル形式別の件数
+    if file_types:
+        st.subheader("ファイル形式別の件数")
+        for file_type, count in file_types:
+            st.write(f"- {file_type}: {count}件")
+
+    # 日別の利用件数（直近30日分）
+    st.subheader("日別の利用件数")
+    chart_data = {}
+    for day, action_type, count, chars_in, chars_out in daily:
+        chart_data.setdefault(day, {})[action_type] = count
+    st.bar_chart(pd.DataFrame.from_dict(chart_data, orient="index").fillna(0))
+
+    with st.expander("日別の詳細"):
+        st.dataframe(
+            pd.DataFrame(daily, columns=["日付", "操作タイプ", "件数", "入力文字数", "出力文字数"]),
+            hide_index=True
+        )
+
 # フッター
 def footer():
     st.markdown("---")
@@ -0,0 +1,299 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+import openai
+
+from core import (
+    SUPPORTED_FILE_TYPES,
+    create_client,
+    init_db,
+    get_user_id,
+    save_history,
+    extract_normalized_text,
+    build_generation_prompt,
+    build_proofreading_prompt,
+    call_llm,
+    llm_scheduler,
+)
+
+# 生成・校閲をStreamlitを介さず一括実行するCLI
+#
+# 使用例:
+#   python batch.py requests.jsonl -o results.jsonl
+#   python batch.py ./materials -o results.jsonl --user compliance --concurrency 4 --rpm 60
+#
+# JSONLの各行は次のいずれかの形式:
+#   {"id": "...", "action": "proofread", "text": "...", "checks": ["文法/スペル"]}
+#   {"id": "...", "action": "proofread", "file": "path/to/file.pdf"}
+#   {"id": "...", "action": "generate", "prompt_type": "SMS", "topic": "...", "length": "...", "additional_info": "..."}
+# 結果はJSONLに1行ずつ追記され、同じ出力先で再実行すると成功済みのidはスキップされる。
+
+ACTION_TYPES = {
+    "generate": "テキスト生成",
+    "proofread": "テキスト校閲",
+}
+
+# 一定間隔でのみ呼び出しを許可するレート制限（スレッドセーフ）
+class RateLimiter:
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    # 待たずに呼び出せる場合のみ許可する（ヘッジの2本目用）
+    def try_acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.next_time > now:
+                return False
+            self.next_time = now + self.interval
+            return True
+
+# 再試行で回復する見込みのある一時的なエラー（接続エラー・レート制限・サーバーエラー）かを判定する関数
+# （締め切りのTimeoutErrorやコンテキスト長超過などの4xxは再試行しても同じ結果になるため対象外）
+def is_transient_error(error):
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+# 入力（JSONLファイルまたはディレクトリ）からジョブ一覧を作成する関数
+def load_jobs(input_path):
+    jobs = []
+
+    if os.path.isdir(input_path):
+        # ディレクトリ内の対応ファイルをすべて校閲対象とする
+        for root, _, files in os.walk(input_path):
+            for name in sorted(files):
+                if name.split('.')[-1].lower() in SUPPORTED_FILE_TYPES:
+                    path = os.path.join(root, name)
+                    jobs.append({
+                        "id": os.path.relpath(path, input_path),
+                        "action": "proofread",
+                        "file": path,
+                    })
+        jobs.sort(key=lambda job: job["id"])
+    else:
+        base_dir = os.path.dirname(os.path.abspath(input_path))
+        with open(input_path, encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                job = json.loads(line)
+                job.setdefault("id", f"line-{line_no}")
+                job.setdefault("action", "proofread")
+                if job["action"] not in ACTION_TYPES:
+                    raise ValueError(f"{line_no}行目: 不明なactionです: {job['action']}")
+                # ファイルパスはJSONLからの相対パスとして解決
+                if job.get("file") and not os.path.isabs(job["file"]):
+                    job["file"] = os.path.join(base_dir, job["file"])
+                jobs.append(job)
+
+    return jobs
+
+# 出力済みの結果から成功したジョブのidを読み込む関数（チェックポイント）
+def load_completed_ids(output_path):
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+
+    with open(output_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 中断時に書きかけとなった行は無視
+                continue
+            if record.get("status") == "ok":
+                completed.add(record["id"])
+    return completed
+
+# ジョブからプロンプトと履歴保存用の内容、記録用の統計を作成する関数
+def prepare_job(job):
+    if job["action"] == "generate":
+        prompt = build_generation_prompt(
+            job.get("prompt_type", "メールマガジン"),
+            job["topic"],
+            job.get("length", "標準 (300字程度)"),
+            job.get("additional_info", "")
+        )
+        return prompt, prompt, None, {}
+
+    file_name = None
+    stats = {}
+    if job.get("file"):
+        file_name = os.path.basename(job["file"])
+        with open(job["file"], 'rb') as f:
+            normalized = extract_normalized_text(file_name, f.read())
+        input_text = normalized.text
+        # 正規化によるトークン削減量を結果に記録
+        stats = {
+            "tokens_before": normalized.original_tokens,
+            "tokens_after": normalized.tokens,
+        }
+    else:
+        input_text = job.get("text", "")
+
+    if not input_text.strip():
+        raise ValueError("校閲対象のテキストが空です。")
+
+    prompt = build_proofreading_prompt(input_text, job.get("checks"))
+    return prompt, input_text, file_name, stats
+
+# 1件のジョブを実行する関数（ワーカースレッドで実行）
+def run_job(client, job, limiter, args, user_id=None):
+    started = time.monotonic()
+    record = {"id": job["id"], "action": job["action"]}
+
+    try:
+        prompt, content, file_name, stats = prepare_job(job)
+        record["file_name"] = file_name
+        record.update(stats)
+
+        for attempt in range(args.retries + 1):
+            limiter.acquire()
+            try:
+                result = call_llm(
+                    client,
+                    job.get("model", args.model),
+                    prompt,
+                    job.get("temperature", args.temperature),
+                    user_id=user_id,
+                    action_type=ACTION_TYPES[job["action"]],
+                    can_hedge=limiter.try_acquire
+                )
+                break
+            except Exception as e:
+                if attempt == args.retries or not is_transient_error(e):
+                    raise
+                # 指数バックオフで再試行
+                time.sleep(2 ** attempt)
+
+        record.update({"status": "ok", "result": result})
+        record["_content"] = content
+    except Exception as e:
+        record.update({"status": "error", "error": str(e)})
+
+    record["elapsed"] = round(time.monotonic() - started, 3)
+    return record
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="生成・校閲を一括実行します。")
+    parser.add_argument("input", help="リクエストのJSONLファイル、またはファイルを格納したディレクトリ")
+    parser.add_argument("-o", "--output", required=True, help="結果を追記するJSONLファイル（チェックポイントを兼ねる）")
+    parser.add_argument("--user", help="結果を履歴に保存するユーザー名")
+    parser.add_argument("--model", default="gpt-4o-mini", help="使用するモデル（既定: gpt-4o-mini）")
+    parser.add_argument("--temperature", type=float, default=0.3, help="温度（既定: 0.3）")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時実行数（既定: 4）")
+    parser.add_argument("--rpm", type=float, default=60, help="1分あたりの最大リクエスト数（0で無制限、既定: 60）")
+    parser.add_argument("--retries", type=int, default=2, help="一時的なエラー（接続・429・5xx）の再試行回数（既定: 2）")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    load_dotenv()
+    args = parse_args(argv)
+
+    client = create_client()
+    if client is None:
+        print("OpenAI APIキーが設定されていません。環境変数OPENAI_API_KEYを設定してください。", file=sys.stderr)
+        return 1
+
+    # LLM呼び出しの記録にも使うため、データベースは常に初期化する
+    init_db()
+
+    user_id = None
+    if args.user:
+        user_id = get_user_id(args.user)
+        if user_id is None:
+            print(f"ユーザーが見つかりません: {args.user}", file=sys.stderr)
+            return 1
+
+    jobs = load_jobs(args.input)
+    completed = load_completed_ids(args.output)
+    pending = [job for job in jobs if job["id"] not in completed]
+    print(f"全{len(jobs)}件（完了済み{len(jobs) - len(pending)}件、実行対象{len(pending)}件）")
+
+    # CLIは1プロセスで1ユーザー分を実行するため、同時実行数は--concurrencyに合わせる
+    llm_scheduler.max_concurrency = args.concurrency
+    llm_scheduler.per_user_concurrency = args.concurrency
+    llm_scheduler.reserved_priority_slots = 0
+
+    limiter = RateLimiter(args.rpm)
+    counts = {"ok": 0, "error": 0}
+
+    # 結果の書き込みと履歴保存はメインスレッドでのみ行う
+    def write_record(out, record):
+        content = record.pop("_content", None)
+
+        if record["status"] == "ok" and user_id is not None:
+            save_history(
+                user_id,
+                ACTION_TYPES[record["action"]],
+                content,
+                record["result"],
+                record.get("file_name")
+            )
+
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+        counts[record["status"]] += 1
+        print(f"[{record['status']}] {record['id']} ({record['elapsed']}s)")
+
+    # 中断時に実行中のジョブを待たないよう、executorはwithを使わず明示的に終了する
+    executor = ThreadPoolExecutor(max_workers=args.concurrency)
+    with open(args.output, 'a', encoding='utf-8') as out:
+        queue = iter(pending)
+        in_flight = set()
+
+        try:
+            while True:
+                # 同時実行数の2倍までを投入しておく
+                while len(in_flight) < args.concurrency * 2:
+                    job = next(queue, None)
+                    if job is None:
+                        break
+                    in_flight.add(executor.submit(run_job, client, job, limiter, args, user_id))
+                if not in_flight:
+                    break
+
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write_record(out, future.result())
+        except KeyboardInterrupt:
+            # 完了済みの結果だけを書き込み、未開始のジョブは取り消す
+            # （実行中だったジョブは出力されないため、再実行で続きから再開できる。
+            #   実行中のスレッドの終了を待たないよう、呼び出し元ではos._exitで終了する）
+            for future in in_flight:
+                if future.done() and not future.cancelled():
+                    write_record(out, future.result())
+            for future in in_flight:
+                future.cancel()
+            executor.shutdown(wait=False)
+            print("中断しました。同じ出力先で再実行すると続きから再開します。", file=sys.stderr)
+            return 130
+
+    executor.shutdown()
+
+    print(f"完了: 成功{counts['ok']}件、失敗{counts['error']}件")
+    return 0 if counts["error"] == 0 else 2
+
+if __name__ == "__main__":
+    exit_code = main()
+    if exit_code == 130:
+        # 中断時は実行中のAPI呼び出し（ワーカースレッド）の完了を待たずにプロセスを終了
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(exit_code)
+    sys.exit(exit_code)
@@ -0,0 +1,791 @@
+import os
+import sqlite3
+import hashlib
+import datetime
+import time
+import io
+
+# 追加ライブラリ
+import openai
+import httpx
+import docx  # Word文書処理用
+import pptx  # PowerPoint処理用
+import PyPDF2  # PDF処理用
+
+from scheduler import LLMScheduler, estimate_tokens
+from text_normalizer import normalize_pages
+from fingerprint import (
+    SIMILAR_MIN_SIMILARITY,
+    compute_minhash,
+    pack_signature,
+    unpack_signature,
+    lsh_buckets,
+    estimate_similarity,
+)
+from hedging import LatencyTracker, hedged_completion
+
+# Streamlitに依存しない生成・校閲・抽出の中核処理
+# （app.pyのUIとbatch.pyのCLIの双方から利用する）
+
+# データベースファイルのパス
+DB_PATH = 'app_data.db'
+
+# 全セッションで共有するLLM呼び出しのスケジューラ
+llm_scheduler = LLMScheduler(
+    max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", "8")),
+    per_user_concurrency=int(os.environ.get("LLM_PER_USER_CONCURRENCY", "2")),
+    reserved_priority_slots=int(os.environ.get("LLM_PRIORITY_SLOTS", "1")),
+)
+
+# 優先レーンで扱う短い入力の上限文字数（SMS・SNS投稿程度）
+PRIORITY_TEXT_LENGTH = 280
+
+# 操作タイプごとのLLM呼び出しの締め切り[秒]
+ACTION_DEADLINES = {
+    "テキスト生成": float(os.environ.get("LLM_DEADLINE_GENERATION", "90")),
+    "テキスト校閲": float(os.environ.get("LLM_DEADLINE_PROOFREADING", "240")),
+}
+DEFAULT_DEADLINE = 240.0
+
+# ヘッジ（最初のトークンが遅い場合の再リクエスト）の設定
+HEDGE_ENABLED = os.environ.get("LLM_HEDGE_ENABLED", "0") == "1"
+HEDGE_PERCENTILE = float(os.environ.get("LLM_HEDGE_PERCENTILE", "0.9"))
+HEDGE_FALLBACK_MODEL = os.environ.get("LLM_HEDGE_FALLBACK_MODEL") or None
+
+# 全セッションで共有する最初のトークンまでの時間の実績
+latency_tracker = LatencyTracker()
+
+# 利用状況の集計キー（日付とファイル形式）を履歴の行から求めるSQL式
+_USAGE_DAY_SQL = "substr({row}.created_at, 1, 10)"
+_USAGE_FILE_TYPE_SQL = (
+    "CASE WHEN {row}.file_name IS NULL OR instr({row}.file_name, '.') = 0 THEN '' "
+    "ELSE lower(substr({row}.file_name, length(rtrim({row}.file_name, replace({row}.file_name, '.', ''))) + 1)) END"
+)
+
+# OpenAIクライアントを作成する関数
+def create_client(api_key=None):
+    api_key = api_key or os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        return None
+    http_client = httpx.Client()
+    return openai.OpenAI(api_key=api_key, http_client=http_client)
+
+# SQLiteデータベースのセットアップ
+def init_db():
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    # ユーザーテーブルの作成（存在しない場合）
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    
+    # 履歴テーブルの作成（存在しない場合）
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        action_type TEXT NOT NULL,
+        content TEXT,
+        result TEXT,
+        file_name TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    ''')
+
+    # LLM呼び出しの記録テーブルの作成（ヘッジ率や無駄になったトークン数の調整用）
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS llm_call_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        action_type TEXT,
+        model TEXT NOT NULL,
+        winner_model TEXT,
+        outcome TEXT NOT NULL,
+        hedged INTEGER NOT NULL,
+        hedge_won INTEGER NOT NULL,
+        hedge_after REAL,
+        first_token_latency REAL,
+        latency REAL,
+        wasted_tokens INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+    conn.commit()
+
+    # スキーマの移行（PRAGMA user_versionで適用済みの段階を管理し、各段階は一度だけ実行）
+    c.execute("PRAGMA user_version")
+    version = c.fetchone()[0]
+
+    if version < 1:
+        # 校閲履歴のMinHash指紋とLSHバケット（旧SimHash形式のテーブルは作り直す）
+        c.execute("DROP TABLE IF EXISTS history_fingerprints")
+        c.execute("DROP TABLE IF EXISTS history_lsh_buckets")
+        c.execute('''
+        CREATE TABLE history_fingerprints (
+            history_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            signature BLOB NOT NULL,
+            FOREIGN KEY (history_id) REFERENCES history (id)
+        )
+        ''')
+        c.execute('''
+        CREATE TABLE history_lsh_buckets (
+            user_id INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            history_id INTEGER NOT NULL
+        )
+        ''')
+        c.execute("CREATE INDEX idx_history_lsh_buckets ON history_lsh_buckets (user_id, bucket)")
+        c.execute("CREATE INDEX idx_history_lsh_buckets_history ON history_lsh_buckets (history_id)")
+        conn.commit()
+
+        # 既存の校閲履歴を索引付け
+        backfill_fingerprints(conn)
+        c.execute("PRAGMA user_version = 1")
+        conn.commit()
+
+    if version < 2:
+        # 利用状況の集計テーブルと、履歴の追加・削除に合わせて集計を更新するトリガー
+        # （テーブルの作成・既存の履歴からの集計・バージョンの更新を1つのトランザクションで行い、
+        #   途中で中断された場合は次回の起動時に最初からやり直す。
+        #   他のプロセスと同時に起動した場合に備え、書き込みロックを取得してからバージョンを再確認する）
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("PRAGMA user_version")
+        if c.fetchone()[0] < 2:
+            c.execute("DROP TRIGGER IF EXISTS trg_history_usage_insert")
+            c.execute("DROP TRIGGER IF EXISTS trg_history_usage_delete")
+            c.execute("DROP TABLE IF EXISTS usage_stats")
+            c.execute('''
+            CREATE TABLE usage_stats (
+                user_id INTEGER NOT NULL,
+                action_type TEXT NOT NULL,
+                day TEXT NOT NULL,
+                file_type TEXT NOT NULL,
+                request_count INTEGER NOT NULL DEFAULT 0,
+                chars_in INTEGER NOT NULL DEFAULT 0,
+                chars_out INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, action_type, day, file_type)
+            )
+            ''')
+            c.execute(f'''
+            INSERT INTO usage_stats (user_id, action_type, day, file_type, request_count, chars_in, chars_out)
+            SELECT user_id, action_type, {_USAGE_DAY_SQL.format(row='history')}, {_USAGE_FILE_TYPE_SQL.format(row='history')},
+                   COUNT(*), SUM(IFNULL(length(content), 0)), SUM(IFNULL(length(result), 0))
+            FROM history
+            GROUP BY 1, 2, 3, 4
+            ''')
+            c.execute(f'''
+            CREATE TRIGGER trg_history_usage_insert
+            AFTER INSERT ON history
+            BEGIN
+                INSERT INTO usage_stats (user_id, action_type, day, file_type, request_count, chars_in, chars_out)
+                VALUES (NEW.user_id, NEW.action_type, {_USAGE_DAY_SQL.format(row='NEW')}, {_USAGE_FILE_TYPE_SQL.format(row='NEW')},
+                        1, IFNULL(length(NEW.content), 0), IFNULL(length(NEW.result), 0))
+                ON CONFLICT (user_id, action_type, day, file_type) DO UPDATE SET
+                    request_count = request_count + 1,
+                    chars_in = chars_in + excluded.chars_in,
+                    chars_out = chars_out + excluded.chars_out;
+            END
+            ''')
+            c.execute(f'''
+            CREATE TRIGGER trg_history_usage_delete
+            AFTER DELETE ON history
+            BEGIN
+                UPDATE usage_stats SET
+                    request_count = request_count - 1,
+                    chars_in = chars_in - IFNULL(length(OLD.content), 0),
+                    chars_out = chars_out - IFNULL(length(OLD.result), 0)
+                WHERE user_id = OLD.user_id AND action_type = OLD.action_type
+                  AND day = {_USAGE_DAY_SQL.format(row='OLD')} AND file_type = {_USAGE_FILE_TYPE_SQL.format(row='OLD')};
+                DELETE FROM usage_stats
+                WHERE user_id = OLD.user_id AND action_type = OLD.action_type
+                  AND day = {_USAGE_DAY_SQL.format(row='OLD')} AND file_type = {_USAGE_FILE_TYPE_SQL.format(row='OLD')}
+                  AND request_count <= 0;
+            END
+            ''')
+            c.execute("PRAGMA user_version = 2")
+        conn.commit()
+
+    conn.close()
+
+# パスワードハッシュ化関数
+def hash_password(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+# ユーザー登録関数
+def register_user(username, password):
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    try:
+        hashed_password = hash_password(password)
+        c.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", 
+                 (username, hashed_password))
+        conn.commit()
+        return True
+    except sqlite3.IntegrityError:
+        # ユーザー名が既に存在する場合
+        return False
+    finally:
+        conn.close()
+
+# ユーザー認証関数
+def authenticate_user(username, password):
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    hashed_password = hash_password(password)
+    c.execute("SELECT id FROM users WHERE username = ? AND password_hash = ?", 
+             (username, hashed_password))
+    user = c.fetchone()
+    conn.close()
+    
+    if user:
+        return user[0]  # ユーザーIDを返す
+    else:
+        return None
+
+# ユーザー名からユーザーIDを取得する関数
+def get_user_id(username):
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+
+    c.execute("SELECT id FROM users WHERE username = ?", (username,))
+    user = c.fetchone()
+    conn.close()
+
+    return user[0] if user else None
+
+# 履歴を保存する関数（日本時間のタイムスタンプを使用）
+def save_history(user_id, action_type, content, result, file_name=None):
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    # タイムスタンプを日本時間（JST）で生成
+    jst_now = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=9)))
+    jst_timestamp = jst_now.strftime('%Y-%m-%d %H:%M:%S')
+    
+    c.execute("""
+    INSERT INTO history (user_id, action_type, content, result, file_name, created_at) 
+    VALUES (?, ?, ?, ?, ?, ?)
+    """, (user_id, action_type, content, result, file_name, jst_timestamp))
+    history_id = c.lastrowid
+
+    # 校閲履歴は類似検索用に指紋を登録
+    if action_type == "テキスト校閲" and content:
+        index_fingerprint(c, history_id, user_id, content)
+
+    conn.commit()
+    conn.close()
+
+    return history_id
+
+# 単一の履歴を削除する関数
+def delete_history_item(history_id):
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+
+    c.execute("DELETE FROM history WHERE id = ?", (history_id,))
+    deleted = c.rowcount > 0
+
+    # 対応する指紋とLSHバケットも削除
+    c.execute("DELETE FROM history_fingerprints WHERE history_id = ?", (history_id,))
+    c.execute("DELETE FROM history_lsh_buckets WHERE history_id = ?", (history_id,))
+
+    conn.commit()
+    conn.close()
+
+    return deleted
+
+# ユーザーの全履歴を削除する関数
+def delete_all_user_history(user_id):
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+
+    c.execute("DELETE FROM history WHERE user_id = ?", (user_id,))
+    deleted_count = c.rowcount
+
+    # 対応する指紋とLSHバケットも削除
+    c.execute("DELETE FROM history_fingerprints WHERE user_id = ?", (user_id,))
+    c.execute("DELETE FROM history_lsh_buckets WHERE user_id = ?", (user_id,))
+
+    conn.commit()
+    conn.close()
+
+    return deleted_count
+
+# ユーザーの履歴を取得する関数（IDを含める）
+def get_user_history(user_id):
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    c.execute("""
+    SELECT id, action_type, content, result, file_name, created_at 
+    FROM history 
+    WHERE user_id = ? 
+    ORDER BY created_at DESC
+    """, (user_id,))
+    
+    history = c.fetchall()
+    conn.close()
+
+    return history
+
+# ユーザーの利用状況の集計を取得する関数（集計テーブルのみを参照）
+def get_usage_stats(user_id, days=30):
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+
+    # 全期間の操作タイプ別の合計
+    c.execute("""
+    SELECT action_type, SUM(request_count), SUM(chars_in), SUM(chars_out)
+    FROM usage_stats
+    WHERE user_id = ?
+    GROUP BY action_type
+    ORDER BY action_type
+    """, (user_id,))
+    totals = c.fetchall()
+
+    # 全期間のファイル形式別の件数
+    c.execute("""
+    SELECT file_type, SUM(request_count)
+    FROM usage_stats
+    WHERE user_id = ? AND file_type != ''
+    GROUP BY file_type
+    ORDER BY 2 DESC
+    """, (user_id,))
+    file_types = c.fetchall()
+
+    # 直近days日分（利用のあった日）の日別・操作タイプ別の集計
+    c.execute("""
+    SELECT day, action_type, SUM(request_count), SUM(chars_in), SUM(chars_out)
+    FROM usage_stats
+    WHERE user_id = ?
+      AND day IN (SELECT DISTINCT day FROM usage_stats WHERE user_id = ? ORDER BY day DESC LIMIT ?)
+    GROUP BY day, action_type
+    ORDER BY day
+    """, (user_id, user_id, days))
+    daily = c.fetchall()
+
+    conn.close()
+
+    return totals, file_types, daily
+
+# 類似検索でバケットから取得する候補数の上限
+SIMILAR_MAX_CANDIDATES = 2000
+
+# 校閲履歴の指紋とLSHバケットを登録する関数（呼び出し側でcommitする）
+def index_fingerprint(c, history_id, user_id, content):
+    signature = compute_minhash(content)
+    c.execute("""
+    INSERT OR REPLACE INTO history_fingerprints (history_id, user_id, signature)
+    VALUES (?, ?, ?)
+    """, (history_id, user_id, pack_signature(signature)))
+    c.execute("DELETE FROM history_lsh_buckets WHERE history_id = ?", (history_id,))
+    c.executemany("""
+    INSERT INTO history_lsh_buckets (user_id, bucket, history_id)
+    VALUES (?, ?, ?)
+    """, [(user_id, bucket, history_id) for bucket in lsh_buckets(signature)])
+
+# 指紋が未登録の校閲履歴を索引付けする関数
+def backfill_fingerprints(conn, batch_size=500):
+    c = conn.cursor()
+    last_id = 0
+
+    while True:
+        c.execute("""
+        SELECT h.id, h.user_id, h.content
+        FROM history h
+        LEFT JOIN history_fingerprints f ON f.history_id = h.id
+        WHERE h.id > ? AND h.action_type = 'テキスト校閲'
+          AND h.content IS NOT NULL AND f.history_id IS NULL
+        ORDER BY h.id
+        LIMIT ?
+        """, (last_id, batch_size))
+        rows = c.fetchall()
+        if not rows:
+            break
+
+        for history_id, user_id, content in rows:
+            index_fingerprint(c, history_id, user_id, content)
+        conn.commit()
+        last_id = rows[-1][0]
+
+# 類似する過去の校閲結果を取得する関数（signatureを渡すと署名の再計算を省略）
+def find_similar_history(user_id, text, limit=3, min_similarity=SIMILAR_MIN_SIMILARITY, signature=None):
+    if not text:
+        return []
+
+    if signature is None:
+        signature = compute_minhash(text)
+    buckets = lsh_buckets(signature)
+
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+
+    # LSHバケットが一致する候補のみを索引経由で取得（全件走査はしない）
+    # 上限を超える場合に類似度の高いものが残るよう、共有するバケット数の多い順に並べる
+    placeholders = ", ".join("?" * len(buckets))
+    c.execute(f"""
+    SELECT f.history_id, f.signature
+    FROM history_lsh_buckets b
+    JOIN history_fingerprints f ON f.history_id = b.history_id
+    WHERE b.user_id = ? AND b.bucket IN ({placeholders})
+    GROUP BY b.history_id
+    ORDER BY COUNT(*) DESC, b.history_id DESC
+    LIMIT ?
+    """, (user_id, *buckets, SIMILAR_MAX_CANDIDATES))
+
+    candidates = []
+    for history_id, stored in c.fetchall():
+        similarity = estimate_similarity(signature, unpack_signature(stored))
+        if similarity >= min_similarity:
+            candidates.append((-similarity, history_id))
+    candidates.sort()
+    candidates = candidates[:limit]
+
+    if not candidates:
+        conn.close()
+        return []
+
+    ids = [history_id for _, history_id in candidates]
+    placeholders = ", ".join("?" * len(ids))
+    c.execute(f"""
+    SELECT id, content, result, file_name, created_at
+    FROM history
+    WHERE id IN ({placeholders})
+    """, ids)
+    rows = {row[0]: row[1:] for row in c.fetchall()}
+    conn.close()
+
+    similar = []
+    for negative_similarity, history_id in candidates:
+        if history_id in rows:
+            similar.append((history_id, -negative_similarity) + rows[history_id])
+    return similar
+
+# 抽出に対応するファイル形式
+SUPPORTED_FILE_TYPES = ["txt", "doc", "docx", "ppt", "pptx", "pdf"]
+
+# ファイル名と内容（bytes）からページ（スライド）ごとのテキストを抽出する関数（失敗時は例外を送出）
+def extract_pages(file_name, file_content):
+    file_type = file_name.split('.')[-1].lower()
+    pages = []
+
+    if file_type == 'txt':
+        # テキストファイルの処理
+        pages.append(file_content.decode('utf-8'))
+
+    elif file_type in ['docx', 'doc']:
+        # Wordファイルの処理
+        doc = docx.Document(io.BytesIO(file_content))
+        pages.append("\n".join([paragraph.text for paragraph in doc.paragraphs if paragraph.text]))
+
+    elif file_type in ['pptx', 'ppt']:
+        # PowerPointファイルの処理
+        prs = pptx.Presentation(io.BytesIO(file_content))
+
+        for slide in prs.slides:
+            slide_text = ""
+            for shape in slide.shapes:
+                if hasattr(shape, "text"):
+                    slide_text += shape.text + "\n"
+            pages.append(slide_text)
+
+    elif file_type == 'pdf':
+        # PDFファイルの処理
+        pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
+
+        # PDFの各ページからテキストを抽出
+        for page_num in range(len(pdf_reader.pages)):
+            page = pdf_reader.pages[page_num]
+            pages.append(page.extract_text() + "\n")
+
+    else:
+        raise ValueError("サポートされていないファイル形式です。")
+
+    return pages
+
+# ファイルからテキストを抽出し、モデルに送る前の正規化を行う関数（失敗時は例外を送出）
+def extract_normalized_text(file_name, file_content):
+    file_type = file_name.split('.')[-1].lower()
+    pages = extract_pages(file_name, file_content)
+
+    # ヘッダー・フッターの除去はページ単位のPDF・PowerPoint、行の結合は折り返しのあるPDFのみ
+    return normalize_pages(
+        pages,
+        remove_furniture=file_type in ['pdf', 'pptx', 'ppt'],
+        rejoin_lines=file_type == 'pdf'
+    )
+
+# アップロードされたファイルからテキストを抽出・正規化する関数（正規化結果とエラーメッセージを返す）
+def extract_text_from_file(uploaded_file):
+    try:
+        return extract_normalized_text(uploaded_file.name, uploaded_file.getvalue()), None
+    except ValueError as e:
+        return None, str(e)
+    except Exception as e:
+        return None, f"ファイルの処理中にエラーが発生しました: {str(e)}"
+
+# テキスト生成用のプロンプトを作成する関数
+def build_generation_prompt(prompt_type, topic, length, additional_info=""):
+    prompt = f"""
+                次の条件に合うテキストを生成してください:
+                - タイプ: {prompt_type}
+                - トピック: {topic}
+                - 長さ: {length}
+                - 追加情報: {additional_info}
+                
+                #金融機関生成AIエージェント
+                あなたは金融機関の広告作成を専門的に支援するAIアシスタントです。
+                金融商品・サービスの広告作成において、法令遵守と効果的なコミュニケーションを両立させる提案を行います。
+
+                ## 基本方針
+                - 金融商品取引法、銀行法、保険業法など関連法規に完全準拠した広告コンテンツを生成する
+                - 誤解を招く表現や過度な期待を抱かせる表現を徹底的に排除する
+                - リスクとリターンの適切なバランスを保った説明を心がける
+                - 対象顧客層に応じた適切な表現と情報量を選択する
+                - 金融機関としての信頼性・安定性を表現しつつ、差別化ポイントを明確に伝える
+
+                ## 広告種類別のガイドライン
+                    **Web広告・バナー**
+                     - 簡潔で明確なメッセージと視覚的一貫性
+                     - クリック後のランディングページとの整合性
+                     - 小さなスペースでも必要な免責事項を表示
+                     - CTAの明確さと行動喚起の適切さ
+
+                    **パンフレット・商品説明資料**
+                    - 段階的な情報提供による理解促進
+                    - 重要事項の視認性確保
+                    - 図表・イラストの効果的活用
+                    - 商品構造・手数料体系の透明な説明
+
+                    **ソーシャルメディア投稿**
+                    - プラットフォーム特性に合わせた最適な表現
+                    - エンゲージメントと法令遵守のバランス
+                    - シリーズ投稿による段階的な情報提供
+                    - コメント対応のための想定Q&A
+
+                ## コンプライアンス要件
+                    **必須開示事項**
+                    - 金融機関名・登録番号
+                    - 手数料・費用の明示
+                    - リスク情報の適切な開示
+                    - 実績数値使用時の出典・条件明示
+
+                    **禁止表現**
+                    - 元本保証がない商品の「安全」「確実」等の表現
+                    - 利回り・リターンの断定的表現
+                    - 他社比較における不適切な優位性主張
+                    - 顧客の投資判断を誤らせる表現
+
+                    **適正表示**
+                    - リスク文言の視認性（文字サイズ、表示時間等）
+                    - 条件付き表現の条件明示
+                    - 専門用語の平易な説明
+                    - 図表・グラフの適切な縮尺と説明
+
+                ## 広告効果向上のポイント
+                    **ターゲティング**
+                    - 顧客セグメント別のニーズ・関心事への合致
+                    - 金融リテラシーレベルに応じた表現の選択
+                    - ライフイベントに合わせたメッセージング
+                    - 商品特性と顧客属性のマッチング
+
+                    **差別化要素**
+                    - 金利・手数料等の定量的優位性
+                    - サービス・サポートの質的優位性
+                    - テクノロジー・利便性の革新性
+                    - 社会的意義・ESG要素の訴求
+
+                    **心理的アプローチ**
+                    - 安心感・信頼性の醸成
+                    - 将来不安の解消・目標達成の支援
+                    - 社会的証明による後押し
+                    - 希少性・適時性の適切な強調
+
+                ## 生成プロセス
+                    1. 広告目的と対象商品・サービスの明確化
+                    2. ターゲット顧客層と媒体の特定
+                    3. 主要メッセージと差別化ポイントの設定
+                    4. コンプライアンス要件の確認とリスク開示の組み込み
+                    5. 広告クリエイティブの生成（複数バージョン）
+                    6. コンプライアンス最終チェック
+
+                ## 注意事項
+                    - 投資・保険商品の広告はとりわけ厳格な規制があることを常に意識する
+                    - 広告表現の解釈は多様であることを考慮し、慎重な表現選択を行う
+                    - ハルシネーション（誤った情報の生成）を防止し、不確かな内容は含めない
+                    - 最新の金融規制に基づいた広告表現を心がけ、必要に応じて確認を促す
+                    - 生成した広告案は必ず金融機関のコンプライアンス部門の確認を受けるよう注記する
+                    効果的な訴求と厳格なコンプライアンス準拠を両立し、金融機関と顧客双方の価値を高める広告制作を支援します。
+                """
+    return prompt
+
+# テキスト校閲用のプロンプトを作成する関数
+def build_proofreading_prompt(input_text, check_options=None):
+    checks = ", ".join(check_options) if check_options else "すべての側面"
+    
+    prompt = f"""
+                #金融機関校閲AIエージェント
+                あなたは金融機関の文書校閲を専門とするAIアシスタントです。
+                正確で信頼性の高い校閲サービスを提供し、金融業界特有の表現、規制要件、コンプライアンスを考慮した適切な修正提案を行います。
+                以下のテキストを校閲してください。{checks}に注目して改善点を指摘し、
+                修正案を提案してください。元のテキストを尊重しつつ、より明確で効果的な表現を目指してください。
+                
+                 テキスト:
+                {input_text}
+                
+                以下の形式で回答してください：
+                1. 全体的な評価
+                2. 具体的な改善点（元の文と修正案を対比）
+                3. 修正後の全文
+
+                ## 校閲の基本方針
+                    - 金融関連法規制に準拠した表現であるかを厳格に確認する
+                    - 数値、金額、日付、商品名等の正確性を最優先で確認する
+                    - 専門用語と平易な表現のバランスを適切に保つ
+                    - 表現の一貫性と統一性を確保する
+                    - リスク開示が適切かつ十分であるかを確認する
+                    - わかりやすさと正確さを両立した文章構成を心がける
+
+                ## 校閲対象文書
+                    **顧客向け資料**
+                    - 金融商品説明資料・パンフレット
+                    - 契約書・約款
+                    - 重要事項説明書
+                    - 顧客宛て通知文
+
+                    **内部文書**
+                    - 業務マニュアル・手順書
+                    - 社内報告書・提案書
+                    - 社内規程・ポリシー
+                    - 研修資料
+
+                    **公開文書**
+                    - プレスリリース
+                    - IR資料・ディスクロージャー
+                    - 採用情報・企業案内
+                    - ウェブサイトコンテンツ
+
+                ## 校閲のポイント
+                    **法令遵守の観点**
+                    - 誤解を招く表現や断定的な表現の排除
+                    - 優位性を示す表現の適切性確認
+                    - 必要な免責事項・注意書きの確認
+                    - 個人情報保護に関する表現の確認
+
+                    **表現・用語の観点**
+                    - 専門用語の適切な使用と説明
+                    - 敬語・謙譲語・丁寧語の正しい使用
+                    - カタカナ語・外来語の統一表記
+                    - 曖昧表現・冗長表現の修正
+
+                    **構成・可読性の観点**
+                    - 論理展開の一貫性と明確さ
+                    - 段落構成・見出しの適切性
+                    - 箇条書き・図表の効果的な活用
+                    - フォントサイズ・書式の統一性
+
+                    **金融特有の観点**
+                    - リスク・リターンのバランスある説明
+                    - 手数料・費用の明確な表示
+                    - 数値・計算例の正確性
+                    - 市場予測に関する適切な表現
+
+                ## 注意事項
+                    - 内容の事実確認は行わず、表現・構成のみを校閲する
+                    - 業界固有の専門用語や略語の使用については慎重に判断する
+                    - ハルシネーション（誤った情報の生成）を防止し、不確かな修正は提案しない
+                    - 文書の目的や対象読者を考慮した校閲を心がける
+                    - 金融商品の内容自体に関する評価・判断は行わない
+                """
+    return prompt
+
+# LLM呼び出しの記録を保存する関数
+def save_llm_call_log(user_id, action_type, info):
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+
+    c.execute("""
+    INSERT INTO llm_call_log (user_id, action_type, model, winner_model, outcome, hedged, hedge_won,
+                              hedge_after, first_token_latency, latency, wasted_tokens)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (user_id, action_type, info["model"], info["winner_model"], info["outcome"],
+          int(info["hedged"]), int(info["hedge_won"]), info["hedge_after"],
+          info["first_token_latency"], info["latency"], info["wasted_tokens"]))
+
+    conn.commit()
+    conn.close()
+
+# 直近のLLM呼び出しのヘッジ率・無駄になったトークン数などを集計する関数
+def get_llm_call_stats(limit=1000):
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+
+    c.execute("""
+    SELECT COUNT(*), SUM(hedged), SUM(hedge_won), SUM(wasted_tokens),
+           SUM(outcome = 'timeout'), SUM(outcome = 'cancelled'), SUM(outcome = 'error')
+    FROM (SELECT * FROM llm_call_log ORDER BY id DESC LIMIT ?)
+    """, (limit,))
+    calls, hedged, hedge_won, wasted_tokens, timeouts, cancelled, errors = c.fetchone()
+    conn.close()
+
+    calls = calls or 0
+    return {
+        "calls": calls,
+        "hedge_rate": (hedged or 0) / calls if calls else 0.0,
+        "hedge_win_rate": (hedge_won or 0) / hedged if hedged else 0.0,
+        "wasted_tokens": wasted_tokens or 0,
+        "timeouts": timeouts or 0,
+        "cancelled": cancelled or 0,
+        "errors": errors or 0,
+    }
+
+# LLMを呼び出して応答テキストを返す関数
+# （スケジューラで実行枠を確保してから、操作タイプごとの締め切りとヘッジ付きで呼び出す。
+#   on_waitには待ち順と推定待ち時間[秒]、on_progressには応答待ちの経過秒数が渡される）
+def call_llm(client, model, prompt, temperature, user_id=None, priority=False, on_wait=None,
+             action_type=None, on_progress=None, can_hedge=None):
+    tokens = estimate_tokens(prompt)
+    # 締め切りは受付時点から数え、順番待ちの時間も含める
+    deadline = ACTION_DEADLINES.get(action_type, DEFAULT_DEADLINE)
+    submitted = time.monotonic()
+
+    def log_call(info):
+        try:
+            save_llm_call_log(user_id, action_type, info)
+        except sqlite3.Error:
+            # 記録の失敗で呼び出し自体を失敗させない
+            pass
+
+    # ヘッジの2本目もスケジューラの枠（とcan_hedgeによる呼び出し元の制限）を確保できた場合のみ送る
+    def acquire_hedge():
+        if can_hedge is not None and not can_hedge():
+            return None
+        ticket = llm_scheduler.try_acquire(user_id, tokens, priority)
+        if ticket is None:
+            return None
+        return lambda: llm_scheduler.release(ticket)
+
+    with llm_scheduler.slot(user_id, tokens, priority, timeout=deadline, on_wait=on_wait):
+        remaining = deadline - (time.monotonic() - submitted)
+        if remaining <= 0:
+            raise TimeoutError(f"応答が{deadline:.0f}秒以内に完了しませんでした。")
+        return hedged_completion(
+            client, model, prompt, temperature, remaining, latency_tracker,
+            hedge=HEDGE_ENABLED,
+            hedge_percentile=HEDGE_PERCENTILE,
+            fallback_model=HEDGE_FALLBACK_MODEL,
+            on_tick=on_progress,
+            on_finish=log_call,
+            acquire_hedge=acquire_hedge
+        )
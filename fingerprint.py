@@ -0,0 +1,135 @@
+import difflib
+import hashlib
+import re
+import struct
+import unicodedata
+
+# 近似重複検出のためのMinHash署名とLSHバンド
+#
+# - 正規化したテキストの文字3-gramを1回だけハッシュし、64個のビンに振り分けて各ビンの最小値を取る
+#   （One Permutation Hashing。空のビンは次のビンの値で埋める）
+# - 署名を4値ずつ16バンドに分け、各バンドのハッシュをLSHバケットとする
+#   Jaccard類似度sの文書が少なくとも1つのバケットを共有する確率は 1-(1-s^4)^16 で、
+#   しきい値のs=0.7で約99%、s=0.8で約99.98%。s=0.3では約12%となり、無関係な文書はほとんど候補にならない
+
+MINHASH_SIZE = 64
+LSH_BANDS = 16
+LSH_ROWS = MINHASH_SIZE // LSH_BANDS
+SIMILAR_MIN_SIMILARITY = 0.7  # 類似とみなす推定Jaccard類似度の下限（LSHの再現率が約99%となる値）
+
+_BIN_VALUE_BITS = 58
+_EMPTY = None
+
+# 指紋計算用にテキストを正規化する関数
+def normalize_for_fingerprint(text):
+    # 全角・半角を統一し、空白を除去
+    text = unicodedata.normalize('NFKC', text).lower()
+    text = re.sub(r'\s+', '', text)
+    # 日付や金利だけが異なる文面を近いものとして扱うため数字を同一視
+    return re.sub(r'\d', '0', text)
+
+# テキストのMinHash署名（64値）を計算する関数
+def compute_minhash(text, shingle_size=3):
+    text = normalize_for_fingerprint(text)
+    if len(text) < shingle_size:
+        shingles = {text}
+    else:
+        shingles = {text[i:i + shingle_size] for i in range(len(text) - shingle_size + 1)}
+
+    bins = [_EMPTY] * MINHASH_SIZE
+    for shingle in shingles:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), 'big')
+        index = h % MINHASH_SIZE
+        value = h >> 6
+        if bins[index] is _EMPTY or value < bins[index]:
+            bins[index] = value
+
+    # 空のビンは後続の空でないビンの値（距離で区別）で埋める
+    signature = list(bins)
+    for i in range(MINHASH_SIZE):
+        if bins[i] is _EMPTY:
+            for step in range(1, MINHASH_SIZE):
+                value = bins[(i + step) % MINHASH_SIZE]
+                if value is not _EMPTY:
+                    signature[i] = (step << _BIN_VALUE_BITS) | value
+                    break
+            else:
+                signature[i] = 0
+    return signature
+
+# 署名をSQLiteに保存するためのバイト列に変換する関数
+def pack_signature(signature):
+    return struct.pack(f'<{MINHASH_SIZE}Q', *signature)
+
+def unpack_signature(data):
+    return list(struct.unpack(f'<{MINHASH_SIZE}Q', data))
+
+# 署名からLSHバケットキーの一覧を求める関数（SQLiteのINTEGERに収まる非負の63bit値）
+def lsh_buckets(signature):
+    buckets = []
+    for band in range(LSH_BANDS):
+        rows = signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]
+        data = struct.pack(f'<B{LSH_ROWS}Q', band, *rows)
+        buckets.append(int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big') >> 1)
+    return buckets
+
+# 2つの署名から推定Jaccard類似度を求める関数
+def estimate_similarity(a, b):
+    return sum(1 for x, y in zip(a, b) if x == y) / MINHASH_SIZE
+
+# 2つのテキストの差分（文単位のunified diff）を作成する関数
+def make_text_diff(old_text, new_text, max_lines=200):
+    def split_sentences(text):
+        return [s for s in re.split(r'(?<=[。！？!?\n])', text or "") if s.strip()]
+
+    diff = difflib.unified_diff(
+        [s.rstrip('\n') for s in split_sentences(old_text)],
+        [s.rstrip('\n') for s in split_sentences(new_text)],
+        fromfile="過去の入力",
+        tofile="今回の入力",
+        lineterm="",
+        n=1
+    )
+    lines = list(diff)
+    if len(lines) > max_lines:
+        lines = lines[:max_lines] + ["..."]
+    return "\n".join(lines)
+
+# LSHの再現率の確認（python fingerprint.py で実行）
+# 一部を書き換えた文面がバケットを共有し、しきい値以上と推定されることと、
+# 無関係な文面がほとんど候補にならないことを確認する
+def check_recall(trials=200, length=400, edit_rate=0.03, seed=0):
+    import random
+
+    rng = random.Random(seed)
+    alphabet = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん、。"
+
+    def random_text():
+        return "".join(rng.choice(alphabet) for _ in range(length))
+
+    def edit(text):
+        chars = list(text)
+        for i in rng.sample(range(length), int(length * edit_rate)):
+            chars[i] = rng.choice(alphabet)
+        return "".join(chars)
+
+    shared = found = unrelated = 0
+    for _ in range(trials):
+        original = random_text()
+        a = compute_minhash(original)
+        b = compute_minhash(edit(original))
+        if set(lsh_buckets(a)) & set(lsh_buckets(b)):
+            shared += 1
+            if estimate_similarity(a, b) >= SIMILAR_MIN_SIMILARITY:
+                found += 1
+        if set(lsh_buckets(a)) & set(lsh_buckets(compute_minhash(random_text()))):
+            unrelated += 1
+
+    print(f"バケット共有率{shared / trials:.1%} 検出率{found / trials:.1%} 無関係な文面の候補率{unrelated / trials:.1%}")
+    assert shared / trials >= 0.95, "書き換えた文面がLSHバケットを共有していません"
+    assert found / trials >= 0.95, "書き換えた文面の推定類似度がしきい値を下回っています"
+    assert unrelated / trials <= 0.02, "無関係な文面が候補になっています"
+    return shared, found, unrelated
+
+if __name__ == "__main__":
+    check_recall()
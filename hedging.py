@@ -0,0 +1,225 @@
+import threading
+import time
+from collections import deque
+
+from scheduler import estimate_tokens
+
+# LLM呼び出しの締め切りとヘッジ（投機的な再リクエスト）
+#
+# - ストリーミングで呼び出し、最初のトークンが届くまでの時間を計測する
+# - 最初のトークンが過去の実績（モデルとプロンプトの大きさごと）の指定パーセンタイルを過ぎても届かない場合、
+#   同じモデル（またはフォールバックモデル）に2本目のリクエストを送り、先に完了した方を採用する。
+#   実績が少ない間はヘッジせず、2本目は同時実行数などの枠を確保できた場合のみ送る
+# - 負けた方のリクエストは打ち切り、出力済みのトークンを無駄になったトークンとして記録する
+# - 締め切りを過ぎた場合はすべてのリクエストを打ち切ってTimeoutErrorを送出する
+
+# ヘッジまでの待ち時間の下限[秒]
+MIN_HEDGE_AFTER = 2.0
+# パーセンタイルの計算に必要な最小の実績数
+MIN_SAMPLES = 20
+# 実績を分けるプロンプトの推定トークン数の区切り（大きなPDFの校閲と短い生成を別々に扱う）
+PROMPT_SIZE_BUCKETS = (1000, 4000, 16000)
+
+# プロンプトの推定トークン数から実績の区分を求める関数
+def prompt_size_bucket(tokens):
+    return sum(1 for limit in PROMPT_SIZE_BUCKETS if tokens >= limit)
+
+# モデルとプロンプトの大きさごとの最初のトークンまでの時間の実績
+class LatencyTracker:
+    def __init__(self, maxlen=500):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.maxlen = maxlen
+
+    def record(self, model, tokens, latency):
+        key = (model, prompt_size_bucket(tokens))
+        with self.lock:
+            self.samples.setdefault(key, deque(maxlen=self.maxlen)).append(latency)
+
+    # 指定パーセンタイルの値（実績が少ない場合はNone）を返す
+    def percentile(self, model, tokens, percentile, default=None):
+        key = (model, prompt_size_bucket(tokens))
+        with self.lock:
+            values = sorted(self.samples.get(key, ()))
+        if len(values) < MIN_SAMPLES:
+            return default
+        index = min(len(values) - 1, int(len(values) * percentile))
+        return max(MIN_HEDGE_AFTER, values[index])
+
+# 1本のストリーミングリクエスト
+class _Attempt:
+    def __init__(self, model, hedge):
+        self.model = model
+        self.hedge = hedge
+        self.started_at = time.monotonic()
+        self.first_token_at = None
+        self.parts = []
+        self.stream = None
+        self.done = False
+        self.error = None
+        self.recorded = False
+        self.cancelled = threading.Event()
+        self.release = None  # ヘッジ用に確保した枠の解放処理
+
+    def cancel(self):
+        self.cancelled.set()
+        stream = self.stream
+        if stream is not None:
+            try:
+                stream.response.close()
+            except Exception:
+                pass
+
+    def run(self, client, messages, temperature, timeout, cond):
+        try:
+            self.stream = client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                stream=True,
+                timeout=timeout,
+            )
+            # 接続中に打ち切られた場合は最初のチャンクを待たずに終了する
+            if self.cancelled.is_set():
+                return
+            for chunk in self.stream:
+                if self.cancelled.is_set():
+                    break
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if self.first_token_at is None:
+                        self.first_token_at = time.monotonic()
+                    self.parts.append(delta)
+            else:
+                self.done = True
+        except Exception as e:
+            if not self.cancelled.is_set():
+                self.error = e
+        finally:
+            # 打ち切り・エラー時もストリームを閉じ、接続をプールに返す
+            if self.stream is not None:
+                try:
+                    self.stream.response.close()
+                except Exception:
+                    pass
+            with cond:
+                cond.notify_all()
+
+# 締め切りとヘッジ付きでチャット補完を実行し、応答テキストを返す関数
+# （on_tickには経過秒数を渡し、on_tickが例外を送出すると全リクエストを打ち切る。
+#   on_finishには成功・失敗・タイムアウト・キャンセルのいずれの場合も記録用の情報を渡す。
+#   acquire_hedgeは2本目の枠を確保して解放処理を返し、確保できない場合はNoneを返す）
+def hedged_completion(client, model, prompt, temperature, deadline, tracker,
+                      hedge=True, hedge_percentile=0.9, fallback_model=None,
+                      on_tick=None, on_finish=None, acquire_hedge=None, tick_interval=0.5):
+    messages = [{"role": "user", "content": prompt}]
+    started = time.monotonic()
+    tokens = estimate_tokens(prompt)
+    hedge_after = tracker.percentile(model, tokens, hedge_percentile)
+    cond = threading.Condition()
+    attempts = []
+
+    def launch(attempt_model, is_hedge, release=None):
+        attempt = _Attempt(attempt_model, is_hedge)
+        attempt.release = release
+        attempts.append(attempt)
+        remaining = max(1.0, deadline - (time.monotonic() - started))
+        threading.Thread(
+            target=attempt.run,
+            args=(client, messages, temperature, remaining, cond),
+            daemon=True
+        ).start()
+
+    info = {
+        "model": model,
+        "hedge_after": hedge_after,
+        "hedged": False,
+        "winner_model": None,
+        "hedge_won": False,
+        "first_token_latency": None,
+        "latency": None,
+        "wasted_tokens": 0,
+        "attempts": 0,
+        "outcome": "ok",
+    }
+
+    # 最初のトークンまでの時間を実績として記録する
+    # （finalでは、最初のトークンが届かないまま打ち切ったリクエストの経過時間を下限値として記録し、
+    #   遅いリクエストほど打ち切られて実績に残らず、パーセンタイルが低く偏るのを防ぐ。
+    #   現在のしきい値より短い経過時間やエラーで終わったリクエストは情報にならないため記録しない）
+    def record_latencies(final=False):
+        now = time.monotonic()
+        for attempt in attempts:
+            if attempt.recorded:
+                continue
+            if attempt.first_token_at is not None:
+                tracker.record(attempt.model, tokens, attempt.first_token_at - attempt.started_at)
+                attempt.recorded = True
+            elif final and attempt.error is None and now - attempt.started_at >= (hedge_after or MIN_HEDGE_AFTER):
+                tracker.record(attempt.model, tokens, now - attempt.started_at)
+                attempt.recorded = True
+
+    def finish(winner, outcome):
+        record_latencies(final=True)
+        for attempt in attempts:
+            if attempt is not winner:
+                attempt.cancel()
+                # 負けたリクエストの入力と出力済みのトークンは無駄になる
+                info["wasted_tokens"] += tokens + estimate_tokens("".join(attempt.parts))
+            if attempt.release is not None:
+                attempt.release()
+                attempt.release = None
+        info["outcome"] = outcome
+        info["latency"] = time.monotonic() - started
+        info["attempts"] = len(attempts)
+        if winner is not None:
+            info["winner_model"] = winner.model
+            info["hedge_won"] = winner.hedge
+            if winner.first_token_at is not None:
+                info["first_token_latency"] = winner.first_token_at - winner.started_at
+        if on_finish is not None:
+            on_finish(info)
+
+    launch(model, False)
+    try:
+        while True:
+            with cond:
+                cond.wait(tick_interval)
+
+            record_latencies()
+
+            winner = next((a for a in attempts if a.done), None)
+            if winner is not None:
+                finish(winner, "ok")
+                return "".join(winner.parts)
+
+            elapsed = time.monotonic() - started
+            failed = [a for a in attempts if a.error is not None]
+            primary = attempts[0]
+
+            slow = hedge_after is not None and elapsed >= hedge_after
+            if hedge and not info["hedged"] and primary.first_token_at is None and \
+                    (slow or primary.error is not None):
+                # 最初のトークンが遅い（または失敗した）場合は、枠を確保できれば2本目を送る
+                # （確保できない場合は次の確認時に再試行する）
+                release = acquire_hedge() if acquire_hedge is not None else None
+                if acquire_hedge is None or release is not None:
+                    info["hedged"] = True
+                    launch(fallback_model or model, True, release)
+                    continue
+
+            if len(failed) == len(attempts):
+                finish(None, "error")
+                raise failed[0].error
+
+            if elapsed >= deadline:
+                finish(None, "timeout")
+                raise TimeoutError(f"応答が{deadline:.0f}秒以内に完了しませんでした。")
+
+            if on_tick is not None:
+                on_tick(elapsed)
+    except BaseException:
+        # キャンセル（Streamlitの再実行など）を含め、処理中のリクエストはすべて打ち切る
+        if info["latency"] is None:
+            finish(None, "cancelled")
+        raise
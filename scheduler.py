@@ -0,0 +1,236 @@
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# LLM呼び出しの受付制御（ユーザーごとの同時実行数制限と推定トークン数による重み付き公平キューイング）
+#
+# - 全体の同時実行数とユーザーごとの同時実行数を制限する
+# - 待ち行列はStart-time Fair Queuingで並べ、推定トークン数の大きいリクエストを
+#   出し続けるユーザーほど後回しになる
+# - SMS・SNS投稿などの短いリクエストは優先レーンに入り、通常レーンより先に処理される。
+#   通常レーンは優先レーン用に確保した枠を使えないため、大きなリクエストで枠が埋まっても
+#   短いリクエストは待たされない
+
+PRIORITY_LANE = 0
+STANDARD_LANE = 1
+LANE_NAMES = {PRIORITY_LANE: "priority", STANDARD_LANE: "standard"}
+
+# テキストのトークン数を概算する関数（ASCIIは4文字で1トークン、それ以外は1文字1トークン）
+def estimate_tokens(text):
+    if not text:
+        return 1
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return max(1, ascii_chars // 4 + (len(text) - ascii_chars))
+
+# 待ち行列中の1件のリクエスト
+class Ticket:
+    def __init__(self, scheduler, user_key, tokens, lane, start_tag, finish_tag, seq):
+        self.scheduler = scheduler
+        self.user_key = user_key
+        self.tokens = tokens
+        self.lane = lane
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.seq = seq
+        self.submitted_at = time.monotonic()
+        self.granted_at = None
+        self.granted = False
+        self.cancelled = False
+
+    def sort_key(self):
+        return (self.lane, self.finish_tag, self.seq)
+
+    # 実行枠が割り当てられるまで待つ（on_waitには順番と推定待ち時間[秒]を渡す）
+    def wait(self, timeout=None, on_wait=None, poll_interval=0.5):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        cond = self.scheduler.cond
+
+        while True:
+            with cond:
+                if self.granted:
+                    return True
+                if deadline is not None and time.monotonic() >= deadline:
+                    self.scheduler._cancel(self)
+                    return False
+                position, est_wait = self.scheduler._status(self)
+                if on_wait is None:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    cond.wait(remaining)
+                    continue
+
+            # コールバック（UIの更新など）はロックの外で呼び出す
+            on_wait(position, est_wait)
+            with cond:
+                if not self.granted:
+                    cond.wait(poll_interval)
+
+    # 待ち行列から取り除く（既に枠が割り当てられていた場合は何もせずFalseを返す）
+    def cancel(self):
+        with self.scheduler.cond:
+            if self.granted:
+                return False
+            self.scheduler._cancel(self)
+            return True
+
+# LLM呼び出しのスケジューラ
+class LLMScheduler:
+    def __init__(self, max_concurrency=8, per_user_concurrency=2,
+                 reserved_priority_slots=1, weights=None, sec_per_token=0.002):
+        self.max_concurrency = max_concurrency
+        self.per_user_concurrency = per_user_concurrency
+        self.reserved_priority_slots = min(reserved_priority_slots, max_concurrency - 1)
+        self.weights = weights or {}
+
+        self.cond = threading.Condition()
+        self.queue = []
+        self.running = {}  # user_key -> 実行中の件数
+        self.running_total = 0
+        self.running_standard = 0
+        self.virtual_time = 0.0
+        self.last_finish = {}  # user_key -> 直近の仮想終了時刻
+        self.seq = itertools.count()
+
+        # 推定待ち時間の計算に使う1トークンあたりの処理時間（指数移動平均）
+        self.sec_per_token = sec_per_token
+
+        # メトリクス
+        self.max_queue_depth = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.wait_times = {lane: deque(maxlen=1000) for lane in LANE_NAMES}
+
+    # リクエストを待ち行列に追加する
+    def submit(self, user_key, tokens, priority=False):
+        with self.cond:
+            lane = PRIORITY_LANE if priority else STANDARD_LANE
+            weight = self.weights.get(user_key, 1.0)
+            start_tag = max(self.virtual_time, self.last_finish.get(user_key, 0.0))
+            finish_tag = start_tag + tokens / weight
+            self.last_finish[user_key] = finish_tag
+
+            ticket = Ticket(self, user_key, tokens, lane, start_tag, finish_tag, next(self.seq))
+            self.queue.append(ticket)
+            self.max_queue_depth = max(self.max_queue_depth, len(self.queue))
+            self._dispatch()
+            return ticket
+
+    # 待たずに実行できる場合のみ枠を確保する（確保できない場合はNone）
+    # （待ち行列に他のリクエストがある場合は追い越さない。ヘッジなど追加のリクエスト用）
+    def try_acquire(self, user_key, tokens, priority=False):
+        with self.cond:
+            lane = PRIORITY_LANE if priority else STANDARD_LANE
+            probe = Ticket(self, user_key, tokens, lane, 0.0, 0.0, -1)
+            if self.queue or not self._can_run(probe):
+                return None
+            return self.submit(user_key, tokens, priority)
+
+    # 実行が終わったリクエストの枠を解放する
+    def release(self, ticket, duration=None):
+        with self.cond:
+            self.running[ticket.user_key] -= 1
+            if not self.running[ticket.user_key]:
+                del self.running[ticket.user_key]
+            self.running_total -= 1
+            if ticket.lane == STANDARD_LANE:
+                self.running_standard -= 1
+            self.completed += 1
+
+            if duration is not None and ticket.tokens > 0:
+                self.sec_per_token = 0.8 * self.sec_per_token + 0.2 * (duration / ticket.tokens)
+
+            self._dispatch()
+
+    # 枠の確保から解放までを行うコンテキストマネージャ
+    @contextmanager
+    def slot(self, user_key, tokens, priority=False, timeout=None, on_wait=None):
+        ticket = self.submit(user_key, tokens, priority)
+        try:
+            if not ticket.wait(timeout, on_wait):
+                raise TimeoutError("LLMの実行待ちがタイムアウトしました。")
+        except BaseException:
+            # Streamlitの再実行などで待機が中断された場合も待ち行列から取り除く
+            # （割り当て済みかの確認と取り消しはロック内で行い、割り当て済みなら枠を解放する）
+            if not ticket.cancel():
+                self.release(ticket)
+            raise
+
+        started = time.monotonic()
+        try:
+            yield ticket
+        finally:
+            self.release(ticket, time.monotonic() - started)
+
+    # 現在の待ち行列と待ち時間の統計を返す
+    def metrics(self):
+        with self.cond:
+            metrics = {
+                "queue_depth": len(self.queue),
+                "max_queue_depth": self.max_queue_depth,
+                "running": self.running_total,
+                "completed": self.completed,
+                "cancelled": self.cancelled,
+                "sec_per_token": self.sec_per_token,
+            }
+            for lane, name in LANE_NAMES.items():
+                waits = sorted(self.wait_times[lane])
+                metrics[f"{name}_queue_depth"] = sum(1 for t in self.queue if t.lane == lane)
+                metrics[f"{name}_wait_avg"] = sum(waits) / len(waits) if waits else 0.0
+                metrics[f"{name}_wait_p95"] = waits[int(len(waits) * 0.95)] if waits else 0.0
+                metrics[f"{name}_wait_max"] = waits[-1] if waits else 0.0
+            return metrics
+
+    # 以下は self.cond を取得した状態で呼び出す
+
+    def _can_run(self, ticket):
+        if self.running_total >= self.max_concurrency:
+            return False
+        if self.running.get(ticket.user_key, 0) >= self.per_user_concurrency:
+            return False
+        if ticket.lane == STANDARD_LANE and \
+                self.running_standard >= self.max_concurrency - self.reserved_priority_slots:
+            return False
+        return True
+
+    def _dispatch(self):
+        self.queue.sort(key=Ticket.sort_key)
+        granted = False
+
+        for ticket in list(self.queue):
+            if self.running_total >= self.max_concurrency:
+                break
+            if not self._can_run(ticket):
+                continue
+
+            self.queue.remove(ticket)
+            ticket.granted = True
+            ticket.granted_at = time.monotonic()
+            self.running[ticket.user_key] = self.running.get(ticket.user_key, 0) + 1
+            self.running_total += 1
+            if ticket.lane == STANDARD_LANE:
+                self.running_standard += 1
+            self.virtual_time = max(self.virtual_time, ticket.start_tag)
+            self.wait_times[ticket.lane].append(ticket.granted_at - ticket.submitted_at)
+            granted = True
+
+        if granted:
+            self.cond.notify_all()
+
+    def _cancel(self, ticket):
+        if ticket in self.queue:
+            self.queue.remove(ticket)
+            ticket.cancelled = True
+            self.cancelled += 1
+            self._dispatch()
+
+    def _status(self, ticket):
+        position = 1
+        tokens_ahead = 0
+        for other in self.queue:
+            if other is ticket:
+                break
+            position += 1
+            tokens_ahead += other.tokens
+        est_wait = (tokens_ahead + ticket.tokens) * self.sec_per_token / self.max_concurrency
+        return position, est_wait
@@ -0,0 +1,175 @@
+import random
+import threading
+import time
+
+import pytest
+
+import scheduler as scheduler_module
+from scheduler import LLMScheduler, Ticket
+
+# 合成ユーザーで受付制御を実行し、ユーザーごとの待ち時間と最大同時実行数を返す
+def simulate(scale=0.00002, seed=0):
+    rng = random.Random(seed)
+    scheduler = LLMScheduler(max_concurrency=4, per_user_concurrency=2, reserved_priority_slots=1)
+    waits = {}
+    running = {}
+    max_running = {}
+    lock = threading.Lock()
+
+    def user(name, count, tokens, priority, interval):
+        threads = []
+        for _ in range(count):
+            def job():
+                submitted = time.monotonic()
+                with scheduler.slot(name, tokens, priority):
+                    with lock:
+                        waits.setdefault(name, []).append(time.monotonic() - submitted)
+                        running[name] = running.get(name, 0) + 1
+                        max_running[name] = max(max_running.get(name, 0), running[name])
+                    time.sleep(tokens * scale)
+                    with lock:
+                        running[name] -= 1
+            thread = threading.Thread(target=job)
+            thread.start()
+            threads.append(thread)
+            time.sleep(rng.uniform(0, interval))
+        for thread in threads:
+            thread.join()
+
+    # 大きなPDFを大量に校閲するユーザーと、短いリクエストを送る複数のユーザー
+    users = [threading.Thread(target=user, args=("heavy", 20, 20000, False, 0.001))]
+    users += [threading.Thread(target=user, args=(f"sms{i}", 5, 300, True, 0.2)) for i in range(3)]
+    users += [threading.Thread(target=user, args=(f"doc{i}", 3, 3000, False, 0.3)) for i in range(2)]
+    for thread in users:
+        thread.start()
+    for thread in users:
+        thread.join()
+
+    return scheduler, waits, max_running
+
+def _average(waits, prefix):
+    values = [w for name, ws in waits.items() if name.startswith(prefix) for w in ws]
+    return sum(values) / len(values)
+
+@pytest.fixture(scope="module")
+def simulation():
+    return simulate()
+
+def test_per_user_concurrency_is_never_exceeded(simulation):
+    scheduler, _, max_running = simulation
+    assert max(max_running.values()) <= scheduler.per_user_concurrency
+
+def test_short_and_light_requests_wait_less_than_heavy_user(simulation):
+    _, waits, _ = simulation
+    assert _average(waits, "sms") * 10 < _average(waits, "heavy")
+    assert _average(waits, "doc") * 2 < _average(waits, "heavy")
+
+def test_scheduler_drains(simulation):
+    scheduler, waits, _ = simulation
+    assert scheduler.running_total == 0
+    assert not scheduler.queue
+    assert scheduler.completed == sum(len(ws) for ws in waits.values())
+
+class Interrupted(BaseException):
+    pass
+
+def test_slot_released_when_interrupted_after_grant():
+    scheduler = LLMScheduler(max_concurrency=2, per_user_concurrency=1, reserved_priority_slots=0)
+    holder = scheduler.submit("user", 10)
+
+    # 待機中に枠が割り当てられた直後に中断される（Streamlitの再実行など）
+    def on_wait(position, est_wait):
+        scheduler.release(holder)
+        raise Interrupted()
+
+    with pytest.raises(Interrupted):
+        with scheduler.slot("user", 10, on_wait=on_wait):
+            pass
+
+    assert scheduler.running_total == 0
+    assert scheduler.running == {}
+    assert not scheduler.queue
+    assert scheduler.cancelled == 0
+
+# 割り当て状態を読んだ直後に、別スレッドから枠の割り当てを割り込ませるチケット
+class RacyTicket(Ticket):
+    @property
+    def granted(self):
+        value = self._granted
+        interleave = getattr(self, "interleave", None)
+        if interleave is not None:
+            self.interleave = None
+            interleave()
+        return value
+
+    @granted.setter
+    def granted(self, value):
+        self._granted = value
+
+def test_slot_released_when_granted_between_check_and_cancel(monkeypatch):
+    monkeypatch.setattr(scheduler_module, "Ticket", RacyTicket)
+    scheduler = LLMScheduler(max_concurrency=2, per_user_concurrency=1, reserved_priority_slots=0)
+    holder = scheduler.submit("user", 10)
+    releaser = threading.Thread(target=scheduler.release, args=(holder,))
+
+    # 中断後の割り当て状態の確認の直後に、別スレッドが枠を解放して待機中のチケットに割り当てる
+    # （確認と取り消しがロック内で行われる場合は、解放は取り消しの後まで待たされる）
+    def interleave():
+        releaser.start()
+        releaser.join(0.2)
+
+    def on_wait(position, est_wait):
+        scheduler.queue[-1].interleave = interleave
+        raise Interrupted()
+
+    with pytest.raises(Interrupted):
+        with scheduler.slot("user", 10, on_wait=on_wait):
+            pass
+    releaser.join()
+
+    assert scheduler.running_total == 0
+    assert scheduler.running == {}
+    assert not scheduler.queue
+
+def test_cancel_reports_whether_ticket_was_still_queued():
+    scheduler = LLMScheduler(max_concurrency=1, per_user_concurrency=1, reserved_priority_slots=0)
+    granted = scheduler.submit("user", 10)
+    queued = scheduler.submit("user", 10)
+    assert granted.granted and not queued.granted
+
+    assert queued.cancel() is True
+    assert granted.cancel() is False
+    assert scheduler.running_total == 1
+    assert not scheduler.queue
+
+def test_slot_timeout_leaves_queue_empty():
+    scheduler = LLMScheduler(max_concurrency=1, per_user_concurrency=1, reserved_priority_slots=0)
+    holder = scheduler.submit("other", 10)
+
+    with pytest.raises(TimeoutError):
+        with scheduler.slot("user", 10, timeout=0.05):
+            pass
+
+    assert not scheduler.queue
+    assert scheduler.cancelled == 1
+    scheduler.release(holder)
+    assert scheduler.running_total == 0
+
+def test_try_acquire_does_not_exceed_limits_or_overtake_queue():
+    scheduler = LLMScheduler(max_concurrency=2, per_user_concurrency=1, reserved_priority_slots=0)
+    first = scheduler.submit("user", 10)
+
+    # ユーザーごとの上限に達している場合は確保しない
+    assert scheduler.try_acquire("user", 10) is None
+
+    # 待ち行列に他のリクエストがある場合は追い越さない
+    queued = scheduler.submit("user", 10)
+    assert scheduler.try_acquire("other", 10) is None
+    queued.cancel()
+
+    hedge = scheduler.try_acquire("other", 10)
+    assert hedge is not None and hedge.granted
+    assert scheduler.running_total == 2
+    scheduler.release(hedge)
+    scheduler.release(first)
+    assert scheduler.running_total == 0
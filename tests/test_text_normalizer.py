@@ -0,0 +1,45 @@
+from text_normalizer import normalize_pages
+
+def test_lines_differing_only_in_numbers_are_kept():
+    pages = [
+        "プランA\n毎月1万円から積立\n手数料 年1.5%\n",
+        "プランB\n毎月3万円から積立\n手数料 年0.8%\n",
+        "プランC\n毎月5万円から積立\n手数料 年0.5%\n",
+    ]
+    normalized = normalize_pages(pages, remove_furniture=True, rejoin_lines=False)
+    for page in pages:
+        for line in page.splitlines():
+            assert line in normalized.text
+
+def test_repeated_sentences_at_page_edge_are_kept():
+    pages = [
+        f"定期預金プラン{i}の金利は年0.{i}%で、最低預入額は10万円からとなっております。\n"
+        "満期時には自動継続となりますので、解約をご希望の場合は詳細は窓口まで\n"
+        "お問い合わせください。\n"
+        f"- {i} -\n"
+        for i in range(1, 6)
+    ]
+    normalized = normalize_pages(pages)
+    assert normalized.text.count("詳細は窓口までお問い合わせください。") == 5
+    assert "窓口まで定期預金" not in normalized.text
+    assert "- 3 -" not in normalized.text
+
+def test_number_only_line_is_kept_unless_it_advances_with_pages():
+    assert normalize_pages(["2025\n本文です。\n"]).text == "2025\n本文です。"
+
+    pages = [f"2025\n第{i}章の本文です。\n" for i in range(5)]
+    assert normalize_pages(pages).text.count("2025") == 5
+
+def test_repeated_header_is_kept_once_and_not_joined_with_body():
+    body = "当社の積立投資プランの特徴と手数料について、具体的な例を挙げながら説明して\nいきます。"
+    pages = [f"株式会社サンプル 社外秘\n{body}\n{i}\n" for i in range(1, 6)]
+    normalized = normalize_pages(pages)
+    assert normalized.text.count("株式会社サンプル 社外秘") == 1
+    assert normalized.text.startswith("株式会社サンプル 社外秘\n当社")
+    assert normalized.text.count("説明していきます。") == 5
+
+def test_edits_map_back_to_original():
+    normalized = normalize_pages(["ｶﾞｲﾄﾞ　ＡＢＣ１２３\n"], remove_furniture=False, rejoin_lines=False)
+    assert normalized.text == "ガイド ABC123"
+    assert [(normalized.original[start:end].strip(), out) for start, end, out in normalized.edits()] == \
+        [("ｶﾞｲﾄﾞ　ＡＢＣ１２３", "ガイド ABC123")]
@@ -0,0 +1,265 @@
+import re
+import unicodedata
+from collections import Counter
+
+from scheduler import estimate_tokens
+
+# ファイルから抽出したテキストをモデルに送る前に正規化する処理
+#
+# - 各ページの先頭・末尾の同じ位置に同じ行が繰り返し現れる場合はヘッダー・フッターとして
+#   最初の1回だけを残し、ページごとに増えていく番号だけの行はページ番号として除去
+# - PDFの行末で途切れた文（ハイフネーションを含む）を1行に結合
+# - 空白の連続をまとめ、全角英数字・半角カナ・合字など意味の変わらない文字のみを統一
+#   （句読点や括弧などの全角記号は校閲対象の表記としてそのまま残す）
+# 正規化後の各文字について元のテキスト中の位置を保持する。
+
+# ヘッダー・フッターの候補とする各ページ先頭・末尾の行数
+FURNITURE_LINES = 2
+# ヘッダー・フッターの判定に必要な最小のページ数
+FURNITURE_MIN_PAGES = 3
+# ヘッダー・フッター・ページ番号とみなす出現ページの割合
+FURNITURE_MIN_RATIO = 0.5
+
+_PAGE_NUMBER_RE = re.compile(
+    r'^(?:p\.?|page)?[-‐–—]?(\d+)(?:/\d+)?[-‐–—]?(?:ページ|頁)?$|^[-‐–—]?(\d+)[-‐–—]?/[-‐–—]?\d+$'
+)
+_SENTENCE_END_RE = re.compile(r'[。．.!?！？:：」』）)]$')
+_LIST_ITEM_RE = re.compile(r'^(?:[・●○■□◆◇※\-*•]|\(?\d+[.)）]|[①-⑳]|[(（]\d+[)）])')
+_SPACES_RE = re.compile(r'[ \t\u00a0\u3000]')
+# 和文の表記として使われるため半角に変換しない全角記号
+_KEEP_FULLWIDTH = set("！（），．：；？［］｛｝～＂＇｀")
+
+# 正規化後のテキストと元のテキストへの位置対応
+class NormalizedText:
+    def __init__(self, original, text, offsets):
+        self.original = original
+        self.text = text
+        self.offsets = offsets  # text[i] は original[offsets[i]] に由来する
+        self.original_tokens = estimate_tokens(original)
+        self.tokens = estimate_tokens(text)
+
+    # 削減できたトークン数の割合
+    @property
+    def token_reduction(self):
+        if not self.original_tokens:
+            return 0.0
+        return 1 - self.tokens / self.original_tokens
+
+    # 正規化で除去・変更した箇所を元のテキストの範囲で返す（空白・改行のみの変更は除く）
+    # [(開始位置, 終了位置, 正規化後の文字列)] の一覧で、除去した箇所の正規化後の文字列は空
+    def edits(self):
+        # 元の同じ位置に由来する文字をまとめる
+        groups = []  # [(元の位置, 正規化後の文字列)]
+        for ch, pos in zip(self.text, self.offsets):
+            if groups and groups[-1][0] == pos:
+                groups[-1] = (pos, groups[-1][1] + ch)
+            else:
+                groups.append((pos, ch))
+
+        raw = []
+        for i, (pos, out) in enumerate(groups):
+            next_pos = groups[i + 1][0] if i + 1 < len(groups) else len(self.original)
+            if out != self.original[pos]:
+                raw.append([pos, pos + 1, out])
+            if next_pos > pos + 1:
+                # 対応する文字のない範囲は除去した箇所
+                raw.append([pos + 1, next_pos, ""])
+        if groups and groups[0][0] > 0:
+            raw.insert(0, [0, groups[0][0], ""])
+        elif not groups and self.original:
+            raw.append([0, len(self.original), ""])
+
+        # 隣接する箇所（半角カナと濁点など）をまとめる
+        merged = []
+        for start, end, out in raw:
+            if merged and merged[-1][1] == start:
+                merged[-1][1] = end
+                merged[-1][2] += out
+            else:
+                merged.append([start, end, out])
+
+        return [
+            (start, end, out) for start, end, out in merged
+            if re.sub(r'\s', '', self.original[start:end]) != re.sub(r'\s', '', out)
+        ]
+
+# ヘッダー・フッター判定用に行を正規化したキーを作る関数（数字は区別する）
+def _furniture_key(line):
+    key = unicodedata.normalize('NFKC', line).lower()
+    return re.sub(r'\s+', '', key)
+
+# 各ページで繰り返し現れるヘッダー・フッターとページ番号の行を求める関数
+# （ページ先頭・末尾からの位置が同じ行だけを比較し、ヘッダー・フッターは最初の出現を残す。
+#   本文を削らないよう、ヘッダー・フッターの候補は文末で終わらない、折り返し幅より短い行に限る）
+def _detect_furniture(page_lines, page_chars, min_length):
+    if len(page_lines) < FURNITURE_MIN_PAGES:
+        return set()
+
+    pages_per_key = {}  # (位置, キー) -> [(ページ番号, 行番号)]
+    numbers = {}  # 位置 -> [(ページ番号, 行番号, 番号)]
+    for page_idx, lines in enumerate(page_lines):
+        non_blank = [i for i, (line, _) in enumerate(lines) if line.strip()]
+        positions = [(('top', k), i) for k, i in enumerate(non_blank[:FURNITURE_LINES])]
+        positions += [(('bottom', k), i) for k, i in enumerate(reversed(non_blank[-FURNITURE_LINES:]))]
+        for position, line_idx in positions:
+            key = _furniture_key(lines[line_idx][0])
+            match = _PAGE_NUMBER_RE.match(key)
+            chars = page_chars[page_idx][line_idx]
+            if match:
+                number = int(match.group(1) or match.group(2))
+                numbers.setdefault(position, []).append((page_idx, line_idx, number))
+            elif not _SENTENCE_END_RE.search(key) and _display_width(chars) < min_length:
+                pages_per_key.setdefault((position, key), []).append((page_idx, line_idx))
+
+    min_pages = max(FURNITURE_MIN_PAGES, len(page_lines) * FURNITURE_MIN_RATIO)
+    furniture = set()
+
+    for occurrences in pages_per_key.values():
+        occurrences = sorted(set(occurrences))
+        if len({page_idx for page_idx, _ in occurrences}) >= min_pages:
+            furniture.update(occurrences[1:])
+
+    # ページ番号は、ページが進むごとに同じだけ増えていく番号が大半のページにある場合のみ除去
+    for entries in numbers.values():
+        shifts = Counter(number - page_idx for page_idx, _, number in entries)
+        shift, count = shifts.most_common(1)[0]
+        if count >= min_pages:
+            furniture.update(
+                (page_idx, line_idx) for page_idx, line_idx, number in entries
+                if number - page_idx == shift
+            )
+
+    return furniture
+
+# 全角英数字・記号を半角に変換してよいかを判定する関数
+def _is_safe_fullwidth(line, i):
+    ch = line[i]
+    if not 0xFF01 <= ord(ch) <= 0xFF5E:
+        return False
+    if ch not in _KEEP_FULLWIDTH:
+        return True
+    # 数字に挟まれた小数点・桁区切りは数値の一部として変換する
+    if ch in "．，" and 0 < i < len(line) - 1:
+        return line[i - 1].isdigit() and line[i + 1].isdigit()
+    return False
+
+# 表示幅（全角文字は2）を求める関数
+def _display_width(chars):
+    return sum(2 if unicodedata.east_asian_width(ch) in 'WF' else 1 for ch, _ in chars)
+
+# 1行分の文字を正規化する関数（(文字, 元の位置)のリストを返す）
+def _normalize_line(line, start):
+    chars = []
+    i = 0
+    while i < len(line):
+        ch = line[i]
+        code = ord(ch)
+        if _is_safe_fullwidth(line, i):
+            # 全角英数字・記号 → 半角
+            chars.append((chr(code - 0xFEE0), start + i))
+        elif 0xFF61 <= code <= 0xFF9F or 0xFB00 <= code <= 0xFB06:
+            # 半角カナ（濁点・半濁点を結合）、合字 → NFKC
+            pair = line[i:i + 2]
+            if len(pair) == 2 and pair[1] in 'ﾞﾟ':
+                converted = unicodedata.normalize('NFKC', pair)
+                if len(converted) == 1:
+                    chars.append((converted, start + i))
+                    i += 2
+                    continue
+            for out in unicodedata.normalize('NFKC', ch):
+                chars.append((out, start + i))
+        else:
+            chars.append((ch, start + i))
+        i += 1
+
+    # 空白の連続を1つにまとめ、行頭・行末の空白を除去
+    collapsed = []
+    for ch, pos in chars:
+        if _SPACES_RE.match(ch):
+            if collapsed and collapsed[-1][0] != ' ':
+                collapsed.append((' ', pos))
+        else:
+            collapsed.append((ch, pos))
+    if collapsed and collapsed[-1][0] == ' ':
+        collapsed.pop()
+    return collapsed
+
+# 前の行と次の行を結合するかどうかを判定する関数
+def _should_join(prev, nxt, min_length):
+    prev_text = "".join(ch for ch, _ in prev)
+    next_text = "".join(ch for ch, _ in nxt)
+    if _display_width(prev) < min_length:
+        return False
+    if _SENTENCE_END_RE.search(prev_text) or _LIST_ITEM_RE.match(next_text):
+        return False
+    return True
+
+# ページごとのテキストを正規化する関数
+def normalize_pages(pages, remove_furniture=True, rejoin_lines=True):
+    original = "".join(pages)
+
+    # ページを行に分割（各行の元のテキスト中の開始位置を保持）
+    page_lines = []
+    offset = 0
+    for page in pages:
+        lines = []
+        for line in page.splitlines(keepends=True):
+            lines.append((line, offset))
+            offset += len(line)
+        page_lines.append(lines)
+
+    page_chars = [
+        [_normalize_line(line.rstrip('\r\n'), start) for line, start in page]
+        for page in page_lines
+    ]
+
+    # 折り返しの判定に使う行の表示幅（長い行の代表値の6割）
+    lengths = sorted(_display_width(chars) for page in page_chars for chars in page if len(chars) >= 10)
+    min_length = lengths[len(lengths) * 3 // 4] * 0.6 if lengths else float('inf')
+
+    furniture = _detect_furniture(page_lines, page_chars, min_length) if remove_furniture else set()
+    lines = []  # [(正規化した文字のリスト, 改行の元の位置, 直前で行を除去したか)]
+    removed_before = False
+    for page_idx, page in enumerate(page_lines):
+        for line_idx, (line, start) in enumerate(page):
+            if (page_idx, line_idx) in furniture:
+                removed_before = True
+                continue
+            chars = page_chars[page_idx][line_idx]
+            lines.append((chars, start + len(line.rstrip('\r\n')), removed_before))
+            if chars:
+                removed_before = False
+
+    result = []
+    blank_run = 0
+    prev = None
+    for chars, newline_pos, after_removed in lines:
+        if not chars:
+            blank_run += 1
+            continue
+
+        if prev is not None:
+            prev_chars, prev_newline = prev
+            if blank_run:
+                # 空行の連続は1行にまとめる
+                result.append(('\n', prev_newline))
+                result.append(('\n', prev_newline))
+            # 除去したヘッダー・フッターを挟む行どうしは結合しない
+            elif rejoin_lines and not after_removed and _should_join(prev_chars, chars, min_length):
+                last = prev_chars[-1][0]
+                first = chars[0][0]
+                if last == '-' and len(prev_chars) > 1 and prev_chars[-2][0].isalpha() and first.islower():
+                    # ハイフネーションで分割された単語を結合
+                    result.pop()
+                elif last.isascii() and last.isalnum() and first.isascii() and first.isalnum():
+                    result.append((' ', prev_newline))
+            else:
+                result.append(('\n', prev_newline))
+
+        result.extend(chars)
+        prev = (chars, newline_pos)
+        blank_run = 0
+
+    text = "".join(ch for ch, _ in result)
+    offsets = [pos for _, pos in result]
+    return NormalizedText(original, text, offsets)